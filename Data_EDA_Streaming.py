@@ -0,0 +1,92 @@
+### 3b. Streaming Data Summaries and Exploratory Data Analysis (EDA) for datasets larger than memory.
+# Same summaries and plots as Data_EDA_Sum.py, but the CSV file is read in chunks and every summary is collected in a
+# single pass, so peak memory depends on the chunk size rather than on the size of the file.
+import seaborn as sns
+import matplotlib.pyplot as plt
+from missingness_map import plot_missingness_map
+from streaming_eda import streaming_eda, plot_histograms, plot_boxplots
+from study_data_loader import load_study_frames, name_mapping
+from wilcoxon_engine import wilcoxon_table
+
+# Mounts Google Drive to access the dataset.
+from google.colab import drive
+drive.mount('/content/drive')
+
+csv_path = '/content/drive/My Drive/Nick_Paper_Education_Exercise_Study_Data_for_Correlation.csv'
+
+# Reads the CSV file in chunks of 100,000 rows and summarizes it in one pass.
+try:
+    summary = streaming_eda(csv_path, chunksize=100_000)
+except FileNotFoundError:
+    print("Error: The specified CSV file was not found. Please check the file path.")
+    exit()
+except Exception as e:
+    print(f"An unexpected error occurred: {e}")
+    exit()
+
+# Dataset Overview. Identifies size of dataset, and data type of each column (int, float, object, etc.).
+print("\nDataset Overview:")
+print(f"Shape of the dataset: {(summary.n_rows, len(summary.columns))}")
+print("\nColumn Data Types:")
+print(summary.dtypes)
+
+# Checks for any missing values.
+print("\nMissing Values Count:")
+print(summary.missing)
+
+# Visualizes any missing values as fractions per block of participants, with columns that tend to be missing together
+# placed side by side.
+fig, ax = plt.subplots(figsize=(10, 6))
+plot_missingness_map(summary.missingness, ax)
+plt.title("Missing Values Map")
+plt.show()
+
+# Summary Statistics for Numerical Data (Descriptive Stats). Quartiles come from the streaming quantile sketch.
+print("\nSummary Statistics for Numerical Data:")
+print(summary.describe())
+
+# Summary for Categorical Data (if any)
+if len(summary.categorical_columns) > 0:
+    print("\nFrequency Counts for Categorical Data:")
+    for col in summary.categorical_columns:
+        print(f"\n{col}:")
+        print(summary.value_counts(col))
+
+# Generates Histograms for Numerical Data from the accumulated bin counts.
+print("\nGenerating histograms for numerical data...")
+plot_histograms(summary, figsize=(12, 10), color='#4E79A7', edgecolor='black')
+plt.suptitle("Distributions of Numeric Data")
+plt.tight_layout()
+plt.show()
+
+# Boxplots for Detecting Outliers, drawn from the sketch quartiles.
+fig, ax = plt.subplots(figsize=(12, 8))
+plot_boxplots(summary, ax)
+plt.title("Boxplots of Numeric Data")
+plt.show()
+
+# Correlation Analysis of entire dataset, from the accumulated pairwise sums.
+print("\nCorrelation Analysis:")
+corr_matrix = summary.corr()
+plt.figure(figsize=(10, 8))
+sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f")
+plt.title("Correlation Heatmap")
+plt.show()
+
+# Statistical Analysis: Mean, Std Dev, and Wilcoxon Test on the baseline and post-education numeric blocks.
+# On the first run the shared loader builds its cache from chunks of 100,000 rows; afterwards it memory-maps the
+# blocks from the cache. Only these numeric columns are loaded for the statistics: the Wilcoxon test reads both blocks
+# in full.
+data_1, data_5 = load_study_frames(csv_path, chunksize=100_000)
+data_1 = data_1.rename(columns=name_mapping)
+data_5 = data_5.rename(columns=name_mapping)
+means_1 = data_1.mean()
+means_5 = data_5.mean()
+std_devs_1 = data_1.std()
+std_devs_5 = data_5.std()
+
+# Performs the Wilcoxon signed-rank tests for all variables in one batched pass and extracts p-values.
+p_values = wilcoxon_table(data_1, data_5)['p-value']
+
+print("\nP-values for each comparison:")
+print(p_values)
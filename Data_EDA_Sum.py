@@ -4,17 +4,26 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import wilcoxon
 import shutil
+from density_pairplot import plot_density_pairplot
+from grouped_analysis import grouped_analysis
+from missingness_map import summarize_missingness, plot_missingness_map
+from stage_profiler import profile_stage, profiler
+from study_data_loader import read_study_csv, split_timepoints, name_mapping, numeric_dtypes
+from wilcoxon_engine import wilcoxon_table
 
 # Mounts Google Drive to access the dataset.
 from google.colab import drive
 drive.mount('/content/drive')
 
 # Loads the CSV file containing pain management before and after an education intervention into a Pandas DataFrame.
+# Set compact_dtypes to True to read the study items as nullable 8-bit integers and text as category,
+# which takes a fraction of the memory; the memory saved is printed.
+compact_dtypes = False
 try:
     # To read the csv file database.
-    data = pd.read_csv('/content/drive/My Drive/Nick_Paper_Education_Exercise_Study_Data_for_Correlation.csv')
+    data = read_study_csv('/content/drive/My Drive/Nick_Paper_Education_Exercise_Study_Data_for_Correlation.csv',
+                          compact=compact_dtypes)
 except FileNotFoundError:
     print("Error: The specified CSV file was not found. Please check the file path.")
     exit()
@@ -32,9 +41,10 @@ print(data.dtypes)
 print("\nMissing Values Count:")
 print(data.isnull().sum())
 
-# Visualizes any missing values.
-plt.figure(figsize=(10, 6))
-sns.heatmap(data.isnull(), cbar=False, cmap='viridis')
+# Visualizes any missing values. Participants are grouped into at most 200 blocks of rows, each cell showing the fraction
+# missing, and columns that tend to be missing together are placed side by side.
+fig, ax = plt.subplots(figsize=(10, 6))
+plot_missingness_map(summarize_missingness(data, n_bins=200), ax)
 plt.title("Missing Values Heatmap")
 plt.show()
 
@@ -43,7 +53,7 @@ print("\nSummary Statistics for Numerical Data:")
 print(data.describe())
 
 # Summary for Categorical Data (if any)
-categorical_cols = data.select_dtypes(include=['object']).columns
+categorical_cols = data.select_dtypes(include=['object', 'category']).columns
 if len(categorical_cols) > 0:
     print("\nFrequency Counts for Categorical Data:")
     for col in categorical_cols:
@@ -51,39 +61,10 @@ if len(categorical_cols) > 0:
         print(data[col].value_counts())
 
 # Selects only numeric data, excluding specific columns.
-numeric_data = data.select_dtypes(include=['float64', 'int64'])
-exclude_columns = ['PainProblems1', 'PainProblems5']
-
-# Filters baseline and post-education data based on column suffixes.
-data_1 = numeric_data.filter(regex='1$|A1$').drop(columns=exclude_columns, errors='ignore')
-data_5 = numeric_data.filter(regex='5$|A2$').drop(columns=exclude_columns, errors='ignore')
-
-# Creates a mapping to rename columns for better readability in plots.
-name_mapping = {
-    'PainDays1': 'Days Manageable Pain',
-    'InterfereActive1': 'Interference Activity',
-    'InterfereMood1': 'Interference Mood',
-    'InterfereSleep1': 'Interference Sleep',
-    'HowHard1': 'Hard to Deal',
-
-    'PainDays5': 'Days Manageable Pain',
-    'InterfereActive5': 'Interference Activity',
-    'InterfereMood5': 'Interference Mood',
-    'InterfereSleep5': 'Interference Sleep',
-    'HowHard5': 'Hard to Deal',
-
-    'Scale1PSA1': 'Pain Severity',
-    'Scale2LIA1': 'Life Interference',
-    'Scale3LCA1': 'Life Control',
-    'Scale4ADA1': 'Affective Distress',
-    'Scale5SA1': 'Support',
-
-    'Scale1PSA2': 'Pain Severity',
-    'Scale2LIA2': 'Life Interference',
-    'Scale3LCA2': 'Life Control',
-    'Scale4ADA2': 'Affective Distress',
-    'Scale5SA2': 'Support'
-}
+numeric_data = data.select_dtypes(include=numeric_dtypes)
+
+# Filters baseline and post-education data based on column suffixes, reusing the already parsed frame.
+data_1, data_5 = split_timepoints(data)
 
 # Applies column renaming to both datasets.
 data_1.rename(columns=name_mapping, inplace=True)
@@ -92,7 +73,8 @@ data_5.rename(columns=name_mapping, inplace=True)
 # Generates Histograms for Numerical Data.
 numeric_cols = numeric_data.columns
 print("\nGenerating histograms for numerical data...")
-numeric_data[numeric_cols].hist(figsize=(12, 10), bins=20, color='#4E79A7', edgecolor='black')
+with profile_stage('eda_histograms'):
+    numeric_data[numeric_cols].hist(figsize=(12, 10), bins=20, color='#4E79A7', edgecolor='black')
 plt.suptitle("Distributions of Numeric Data")
 plt.tight_layout()
 plt.show()
@@ -111,12 +93,12 @@ sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f")
 plt.title("Correlation Heatmap")
 plt.show()
 
-# Pairplot for Key Variables.
-# Adjusts the number of columns for pairplot
-selected_columns = data_1.columns[:4]  
-if len(selected_columns) > 1:
-    print("\nGenerating pairplot for selected data...")
-    sns.pairplot(data_1[selected_columns])
+# Pairplot for all baseline measures, drawn from binned counts instead of one point per participant.
+# Set pairplot_samples to a number of rows to bin a random sample instead of every participant.
+pairplot_samples = None
+if len(data_1.columns) > 1:
+    print("\nGenerating pairplot for baseline data...")
+    plot_density_pairplot(data_1, bins=20, n_samples=pairplot_samples)
     plt.show()
 
 # Statistical Analysis: Mean, Std Dev, and Wilcoxon Test
@@ -125,12 +107,23 @@ means_5 = data_5.mean()
 std_devs_1 = data_1.std()
 std_devs_5 = data_5.std()
 
-# Performs the Wilcoxon signed-rank tests and extracts p-values.
-p_values = pd.Series({col: wilcoxon(data_1[col], data_5[col]).pvalue for col in means_1.index})
+# Performs the Wilcoxon signed-rank tests for all variables in one batched pass and extracts p-values.
+wilcoxon_results = wilcoxon_table(data_1, data_5)
+p_values = wilcoxon_results['p-value']
 
 print("\nP-values for each comparison:")
 print(p_values)
 
+# Repeats the correlations and Wilcoxon tests within each group of a categorical column (e.g. site, sex or arm).
+# Set group_column to one of the categorical columns listed above, or to a list of them to cross the groups.
+group_column = None
+if group_column is not None:
+    grouped_results = grouped_analysis(data, group_column)
+    print("\nParticipants per group:")
+    print(grouped_results['n'])
+    print("\nWilcoxon p-values per group:")
+    print(grouped_results['wilcoxon']['p-value'].unstack(level='variable'))
+
 # Creates a DataFrame for Plotting Results.
 plot_data = pd.DataFrame({
     "Variable": means_1.index,
@@ -143,5 +136,12 @@ plot_data = pd.DataFrame({
 
 # Saves Cleaned Data.
 output_path = '/content/drive/My Drive/cleaned_processed_pain_data.csv'
-data.to_csv(output_path, index=False)
+with profile_stage('save_cleaned_data'):
+    data.to_csv(output_path, index=False)
+    profiler.record_artifact(output_path)
 print(f"\nCleaned data saved to: {output_path}")
+
+# Saves the wall/CPU time, memory use and file sizes of every stage of this run as a Chrome trace (open it in
+# chrome://tracing or Perfetto) and prints them as a table.
+profiler.save_trace('Data_EDA_Sum_trace.json')
+print(profiler.summary().to_string(index=False))
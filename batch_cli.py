@@ -0,0 +1,218 @@
+# Headless batch runner for many cohorts (e.g. one CSV per site). The scripts mount Google Drive and read one
+# hard-coded path; this command reads a manifest of datasets instead and runs the EDA summaries, the correlation
+# heatmaps and the Wilcoxon comparison for every dataset in a process pool. Each worker handles one dataset at a time,
+# can be capped at a maximum address space, and is replaced after every dataset so memory does not build up.
+# Outputs go to <output_dir>/<dataset name>/, and a per-dataset timing summary to <output_dir>/timing_summary.csv.
+#
+#     python batch_cli.py manifest.json --workers 4 --max-memory-mb 4096
+#
+# The manifest is a JSON file:
+#     {"output_dir": "batch_output",
+#      "config": {"name_mapping": {...}, "exclude_columns": [...], "baseline_regex": "1$|A1$", "post_regex": "5$|A2$",
+#                 "figure_format": "svg", "dpi": 1200, "stats_only": false, "compact_dtypes": false},
+#      "datasets": [{"name": "site01", "csv_path": "data/site01.csv"}, ...]}
+# Every config entry is optional and defaults to the settings in study_data_loader.py; a dataset given as a plain
+# path is named after its file. With stats_only (or --stats-only) only the correlation/p-value matrices and the
+# Wilcoxon table are written, and the workers never import matplotlib or seaborn. compact_dtypes reads the study
+# items as nullable 8-bit integers (see study_data_loader.read_study_csv).
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import study_data_loader
+from figure_export import export_figure
+from stage_profiler import profile_stage, profiler
+from study_data_loader import read_study_csv, split_timepoints
+from stats_only import write_stats_tables
+from study_pipeline import plot_heatmap, plot_wilcoxon_bars, wilcoxon_plot_data
+
+
+# Function to fill in the config defaults from study_data_loader.
+def _resolve_config(config):
+    return {
+        'name_mapping': config.get('name_mapping', study_data_loader.name_mapping),
+        'exclude_columns': config.get('exclude_columns', study_data_loader.exclude_columns),
+        'baseline_regex': config.get('baseline_regex', study_data_loader.baseline_regex),
+        'post_regex': config.get('post_regex', study_data_loader.post_regex),
+        'figure_format': config.get('figure_format', 'svg'),
+        'dpi': config.get('dpi', 1200),
+        'stats_only': config.get('stats_only', False),
+        'compact_dtypes': config.get('compact_dtypes', False),
+    }
+
+
+# Function to read the manifest and return (datasets, config, output_dir). Relative CSV paths and output_dir are
+# resolved against the folder of the manifest.
+def read_manifest(manifest_path):
+    with open(manifest_path) as handle:
+        manifest = json.load(handle)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    datasets = []
+    for entry in manifest['datasets']:
+        if isinstance(entry, str):
+            entry = {'csv_path': entry}
+        csv_path = os.path.join(base_dir, entry['csv_path'])
+        name = entry.get('name', os.path.splitext(os.path.basename(csv_path))[0])
+        datasets.append({'name': name, 'csv_path': csv_path})
+    names = [dataset['name'] for dataset in datasets]
+    if len(set(names)) != len(names):
+        raise ValueError("Dataset names in the manifest must be unique.")
+    output_dir = os.path.join(base_dir, manifest.get('output_dir', 'batch_output'))
+    return datasets, _resolve_config(manifest.get('config', {})), output_dir
+
+
+# Function run once in every worker process: headless plotting and, if requested, a cap on the address space.
+# matplotlib is only switched to Agg here if it is already loaded; otherwise MPLBACKEND applies when it is imported.
+def _init_worker(max_memory_bytes):
+    if 'matplotlib' in sys.modules:
+        sys.modules['matplotlib'].use('Agg', force=True)
+    else:
+        os.environ['MPLBACKEND'] = 'Agg'
+    if max_memory_bytes:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+
+
+# Function to write the EDA summaries and plots of one dataset: shape and dtypes, missing values, descriptive
+# statistics, categorical frequencies and the histograms of the numeric columns.
+def _run_eda(data, out_dir, config):
+    import matplotlib.pyplot as plt
+    from missingness_map import plot_missingness_map, summarize_missingness
+
+    with open(os.path.join(out_dir, 'overview.txt'), 'w') as handle:
+        handle.write(f"Shape of the dataset: {data.shape}\n\nColumn Data Types:\n{data.dtypes.to_string()}\n")
+    data.isnull().sum().rename('missing').to_csv(os.path.join(out_dir, 'missing_values.csv'))
+    data.describe().to_csv(os.path.join(out_dir, 'summary_statistics.csv'))
+    categorical_cols = data.select_dtypes(include=['object', 'string', 'category']).columns
+    if len(categorical_cols) > 0:
+        frequencies = pd.concat({col: data[col].value_counts() for col in categorical_cols}, names=['column', 'value'])
+        frequencies.rename('count').to_csv(os.path.join(out_dir, 'categorical_frequencies.csv'))
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    plot_missingness_map(summarize_missingness(data, n_bins=200), ax)
+    ax.set_title("Missing Values Heatmap")
+    export_figure(fig, os.path.join(out_dir, f"missing_values.{config['figure_format']}"), dpi=config['dpi'],
+                  bbox_inches='tight')
+    plt.close(fig)
+
+    numeric_data = data.select_dtypes(include=study_data_loader.numeric_dtypes)
+    if numeric_data.shape[1] > 0:
+        numeric_data.hist(figsize=(12, 10), bins=20, color='#4E79A7', edgecolor='black')
+        plt.suptitle("Distributions of Numeric Data")
+        plt.tight_layout()
+        export_figure(plt.gcf(), os.path.join(out_dir, f"histograms.{config['figure_format']}"), dpi=config['dpi'])
+        plt.close('all')
+
+
+# Function to draw and export the combined heatmap of both timepoints.
+def _plot_heatmaps(matrices, out_dir, config):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(8, 12))
+    plt.subplot(2, 1, 1)
+    plot_heatmap(*matrices[0], 'Spearman Rho Correlation Matrix: Baseline')
+    plt.subplot(2, 1, 2)
+    plot_heatmap(*matrices[1], 'Spearman Rho Correlation Matrix: After Education')
+    plt.tight_layout()
+    export_figure(fig, os.path.join(out_dir, f"combined_correlation_heatmap.{config['figure_format']}"),
+                  dpi=config['dpi'])
+    plt.close(fig)
+
+
+# Function to draw and export the Wilcoxon comparison bar chart.
+def _plot_wilcoxon(data_1, data_5, wilcoxon_results, out_dir, config):
+    import matplotlib.pyplot as plt
+
+    fig = plot_wilcoxon_bars(wilcoxon_plot_data(data_1, data_5, wilcoxon_results['p-value']))
+    export_figure(fig, os.path.join(out_dir, f"comparison_wilcoxon_bar_plot.{config['figure_format']}"),
+                  dpi=config['dpi'])
+    plt.close('all')
+
+
+# Function to process one dataset from start to finish. Returns its status and the wall time of every stage; an error
+# fails only this dataset.
+def process_dataset(dataset, config, output_dir):
+    out_dir = os.path.join(output_dir, dataset['name'])
+    os.makedirs(out_dir, exist_ok=True)
+    profiler.reset()
+    start = time.perf_counter()
+    result = {'dataset': dataset['name'], 'csv_path': dataset['csv_path'], 'status': 'ok', 'error': ''}
+    try:
+        with profile_stage('load'):
+            data = read_study_csv(dataset['csv_path'], compact=config['compact_dtypes'])
+            data_1, data_5 = split_timepoints(data, config['exclude_columns'], config['baseline_regex'],
+                                              config['post_regex'])
+            data_1 = data_1.rename(columns=config['name_mapping'])
+            data_5 = data_5.rename(columns=config['name_mapping'])
+        result['n_rows'], result['n_variables'] = data_1.shape
+        with profile_stage('statistics'):
+            matrices, wilcoxon_results = write_stats_tables(data_1, data_5, out_dir)
+        if not config['stats_only']:
+            with profile_stage('eda'):
+                _run_eda(data, out_dir, config)
+            with profile_stage('heatmaps'):
+                _plot_heatmaps(matrices, out_dir, config)
+            with profile_stage('bar_chart'):
+                _plot_wilcoxon(data_1, data_5, wilcoxon_results, out_dir, config)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+    for event in profiler.events:
+        if event['depth'] == 0:
+            result[f"{event['name']}_seconds"] = event['wall_seconds']
+    result['total_seconds'] = time.perf_counter() - start
+    profiler.save_trace(os.path.join(out_dir, 'stage_trace.json'))
+    return result
+
+
+# Function to process every dataset of the manifest in a pool of n_workers processes and write the timing summary.
+# max_memory_bytes caps the address space of each worker (Linux/macOS); a dataset that exceeds it fails on its own.
+def run_batch(datasets, config, output_dir, n_workers=None, max_memory_bytes=None):
+    os.makedirs(output_dir, exist_ok=True)
+    n_workers = n_workers or min(len(datasets), os.cpu_count() or 1)
+    pool_options = {'max_workers': n_workers, 'initializer': _init_worker, 'initargs': (max_memory_bytes,)}
+    if sys.version_info >= (3, 11):
+        pool_options['max_tasks_per_child'] = 1
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(**pool_options) as pool:
+        futures = {pool.submit(process_dataset, dataset, config, output_dir): dataset for dataset in datasets}
+        for future in as_completed(futures):
+            dataset = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. killed for exceeding memory).
+                result = {'dataset': dataset['name'], 'csv_path': dataset['csv_path'], 'status': 'failed',
+                          'error': f"{type(e).__name__}: {e}"}
+            print(f"{result['dataset']}: {result['status']} {result['error']}".rstrip())
+            results.append(result)
+
+    order = {dataset['name']: i for i, dataset in enumerate(datasets)}
+    summary = pd.DataFrame(sorted(results, key=lambda result: order[result['dataset']]))
+    summary.to_csv(os.path.join(output_dir, 'timing_summary.csv'), index=False)
+    print(f"\nProcessed {len(datasets)} datasets with {n_workers} workers in {time.perf_counter() - start:.1f} s")
+    print(summary.drop(columns=['csv_path', 'error']).to_string(index=False))
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the EDA, correlation heatmaps and Wilcoxon comparisons for '
+                                                 'every dataset of a manifest.')
+    parser.add_argument('manifest', help='JSON manifest of datasets and shared config')
+    parser.add_argument('--output-dir', help='overrides the output_dir of the manifest')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--max-memory-mb', type=int, help='address space limit of each worker in MiB')
+    parser.add_argument('--stats-only', action='store_true', help='write the statistics tables without any figures')
+    args = parser.parse_args()
+    datasets, config, output_dir = read_manifest(args.manifest)
+    if args.stats_only:
+        config['stats_only'] = True
+    summary = run_batch(datasets, config, args.output_dir or output_dir, n_workers=args.workers,
+                        max_memory_bytes=args.max_memory_mb * 2 ** 20 if args.max_memory_mb else None)
+    sys.exit(1 if (summary['status'] != 'ok').any() else 0)
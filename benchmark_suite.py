@@ -0,0 +1,261 @@
+# Benchmark suite for the analysis scripts. synthetic_study_data generates a CSV with the same schema as the study
+# data (PainDays1/5, Interfere*1/5, HowHard1/5 and Scale*A1/A2 on their Likert/ordinal scales, with ties and missing
+# values), scaled to any number of participants and extra scales. run_benchmark times every stage of the scripts
+# separately on it: CSV load and filter, create_corr_matrix, the pairwise-complete Spearman pass on continuous data with
+# missing values, the Wilcoxon pass, plot_heatmap, the bar chart, the EDA histograms and the figure export. The other
+# statistics and the figures use the same data without missing values, so every correlation and p-value is defined.
+# Results are saved as JSON so runs can be compared over time.
+#
+#     python benchmark_suite.py --rows 1000 100000 --extra-scales 0 20 --compare benchmark_results/<earlier>.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from correlation_engine import pairwise_spearman
+from study_data_loader import load_study_frames, numeric_dtypes, read_study_csv, split_timepoints
+from study_pipeline import create_corr_matrix, plot_heatmap, plot_wilcoxon_bars, wilcoxon_plot_data
+from wilcoxon_engine import wilcoxon_table
+
+# Items of the study questionnaire: (baseline name, post name, lowest value, highest value, step).
+study_items = [
+    ('PainDays1', 'PainDays5', 0, 30, 1),
+    ('InterfereActive1', 'InterfereActive5', 0, 10, 1),
+    ('InterfereMood1', 'InterfereMood5', 0, 10, 1),
+    ('InterfereSleep1', 'InterfereSleep5', 0, 10, 1),
+    ('HowHard1', 'HowHard5', 1, 5, 1),
+    ('Scale1PSA1', 'Scale1PSA2', 0, 6, 1 / 3),
+    ('Scale2LIA1', 'Scale2LIA2', 0, 6, 1 / 3),
+    ('Scale3LCA1', 'Scale3LCA2', 0, 6, 1 / 3),
+    ('Scale4ADA1', 'Scale4ADA2', 0, 6, 1 / 3),
+    ('Scale5SA1', 'Scale5SA2', 0, 6, 1 / 3),
+]
+
+
+# Function to generate a synthetic study dataset: an ID and group column, PainProblems1/5 (excluded from the analyses),
+# the study items and n_extra_scales further 0-6 scales (Scale6XA1/A2, ...). All items load on one latent pain factor,
+# so they correlate like the real data, and the post-education scores are shifted down by `effect` standard
+# deviations. Values are rounded to each item's scale (giving many ties), and missing_rate of the cells are missing.
+def synthetic_study_data(n_rows, n_extra_scales=0, missing_rate=0.05, effect=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    items = study_items + [(f'Scale{6 + i}XA1', f'Scale{6 + i}XA2', 0, 6, 1 / 3) for i in range(n_extra_scales)]
+    latent_1 = rng.normal(size=n_rows)
+    latent_5 = 0.8 * latent_1 + 0.6 * rng.normal(size=n_rows) - effect
+    columns = {
+        'ID': np.arange(1, n_rows + 1),
+        'Group': rng.choice(['Education', 'Exercise'], size=n_rows),
+        'PainProblems1': rng.integers(0, 2, size=n_rows),
+        'PainProblems5': rng.integers(0, 2, size=n_rows),
+    }
+    loadings = rng.uniform(0.4, 0.9, size=len(items))
+    for (name_1, name_5, low, high, step), loading in zip(items, loadings):
+        centre, spread = (low + high) / 2, (high - low) / 4
+        for name, latent in ((name_1, latent_1), (name_5, latent_5)):
+            noise = np.sqrt(1 - loading ** 2) * rng.normal(size=n_rows)
+            values = np.clip(np.round((centre + spread * (loading * latent + noise) - low) / step) * step + low,
+                             low, high)
+            values[rng.random(n_rows) < missing_rate] = np.nan
+            columns[name] = values
+    return pd.DataFrame(columns)
+
+
+# Function to time one stage `repeats` times. setup() is called before every repeat and its result is passed to the
+# stage, so that work such as building the figure to export is not counted. Returns the stage's last result.
+def _time_stage(stages, name, function, repeats, setup=None, teardown=None):
+    seconds = []
+    result = None
+    for _ in range(repeats):
+        arguments = setup() if setup is not None else ()
+        start = time.perf_counter()
+        result = function(*arguments)
+        seconds.append(time.perf_counter() - start)
+        if teardown is not None:
+            teardown(result)
+    stages[name] = {'seconds': seconds, 'best': min(seconds), 'median': float(np.median(seconds))}
+    return result
+
+
+# Function to run every stage of the scripts once per repeat on a synthetic dataset of n_rows participants and
+# returns the timings. Figures are drawn on the headless Agg backend and exported to a temporary folder.
+def run_benchmark(n_rows, n_extra_scales=0, repeats=3, export_format='svg', dpi=1200, seed=0):
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    from figure_export import export_figure
+
+    stages = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        csv_path = os.path.join(work_dir, 'synthetic_study_data.csv')
+        synthetic_study_data(n_rows, n_extra_scales=n_extra_scales, seed=seed).to_csv(csv_path, index=False)
+
+        # Load and filter: CSV parsing plus the numeric/timepoint split, then the cached loader (first run writes the
+        # cache, later runs memory-map it).
+        data = _time_stage(stages, 'read_csv', read_study_csv, repeats, setup=lambda: (csv_path,))
+        data_1, data_5 = _time_stage(stages, 'split_timepoints', split_timepoints, repeats, setup=lambda: (data,))
+        cache_dir = os.path.join(work_dir, 'cache')
+        _time_stage(stages, 'load_study_frames_cold', lambda: load_study_frames(csv_path, cache_dir=cache_dir), 1)
+        _time_stage(stages, 'load_study_frames_warm', lambda: load_study_frames(csv_path, cache_dir=cache_dir),
+                    repeats)
+
+        # Pairwise-complete correlations of continuous data with missing values take the slowest path of
+        # pairwise_spearman (correlation_engine._masked_rank_sums); tiny noise breaks the ties of the ordinal items.
+        continuous_data = data_1 + np.random.default_rng(seed).uniform(0, 1e-6, size=data_1.shape)
+        _time_stage(stages, 'pairwise_spearman_masked', pairwise_spearman, repeats, setup=lambda: (continuous_data,))
+
+        # Statistics and figures run on the same participants without missing answers (same seed): with missing
+        # values the listwise Spearman matrix and the Wilcoxon p-values are all NaN, and the heatmap and bar chart
+        # stages would time empty figures.
+        complete_data = synthetic_study_data(n_rows, n_extra_scales=n_extra_scales, missing_rate=0.0, seed=seed)
+        data_1, data_5 = split_timepoints(complete_data)
+        # The scripts pair the timepoints by renaming both frames with name_mapping; the extra synthetic scales have
+        # no readable name, so the post-education columns simply take the baseline names.
+        data_5 = data_5.set_axis(data_1.columns, axis=1)
+
+        # Statistics.
+        corr_matrix, p_values = _time_stage(stages, 'create_corr_matrix', create_corr_matrix, repeats,
+                                            setup=lambda: (data_1,))
+        wilcoxon_results = _time_stage(stages, 'wilcoxon_table', wilcoxon_table, repeats,
+                                       setup=lambda: (data_1, data_5))
+
+        # Figures, each closed after it has been timed.
+        def close(_):
+            plt.close('all')
+
+        def draw_heatmap():
+            plt.figure(figsize=(8, 6))
+            plot_heatmap(corr_matrix, p_values, 'Spearman Rho Correlation Matrix: Baseline')
+            return plt.gcf()
+
+        def draw_bars():
+            return plot_wilcoxon_bars(wilcoxon_plot_data(data_1, data_5, wilcoxon_results['p-value']))
+
+        def draw_histograms():
+            numeric_data = data.select_dtypes(include=numeric_dtypes)
+            numeric_data.hist(figsize=(12, 10), bins=20, color='#4E79A7', edgecolor='black')
+            return plt.gcf()
+
+        _time_stage(stages, 'plot_heatmap', draw_heatmap, repeats, teardown=close)
+        _time_stage(stages, 'bar_chart', draw_bars, repeats, teardown=close)
+        _time_stage(stages, 'eda_histograms', draw_histograms, repeats, teardown=close)
+
+        # Export of already drawn figures; the file sizes are kept with the timings.
+        sizes = {}
+        for name, draw in (('heatmap', draw_heatmap), ('bar_chart', draw_bars)):
+            filename = os.path.join(work_dir, f'{name}.{export_format}')
+            report = _time_stage(stages, f'export_{name}', export_figure, repeats,
+                                 setup=lambda draw=draw, filename=filename: (draw(), filename, dpi), teardown=close)
+            sizes[name] = report['bytes']
+
+    return {
+        'n_rows': n_rows,
+        'n_variables': data_1.shape[1],
+        'n_extra_scales': n_extra_scales,
+        'repeats': repeats,
+        'export_format': export_format,
+        'dpi': dpi,
+        'export_bytes': sizes,
+        'stages': stages,
+    }
+
+
+# Function to describe the environment of a benchmark run, so runs on different machines or versions are not mixed up.
+def _environment():
+    import matplotlib
+    import scipy
+    import seaborn
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scipy': scipy.__version__,
+        'matplotlib': matplotlib.__version__,
+        'seaborn': seaborn.__version__,
+    }
+
+
+# Function to run the benchmark for every combination of sizes and save all results to one JSON file in output_dir.
+# Returns the path of the file.
+def run_benchmarks(row_counts=(1000, 10000), extra_scale_counts=(0,), repeats=3, output_dir='benchmark_results',
+                   export_format='svg', dpi=1200):
+    created = datetime.now(timezone.utc)
+    results = {'created': created.isoformat(), 'environment': _environment(), 'runs': []}
+    for n_rows in row_counts:
+        for n_extra_scales in extra_scale_counts:
+            run = run_benchmark(n_rows, n_extra_scales=n_extra_scales, repeats=repeats,
+                                export_format=export_format, dpi=dpi)
+            results['runs'].append(run)
+            print(f"{n_rows} rows x {run['n_variables']} variables:")
+            for name, timing in run['stages'].items():
+                print(f"  {name:<24} {timing['best']:9.4f} s (median {timing['median']:.4f} s)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"benchmark_{created.strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Saved benchmark results to {path}")
+    return path
+
+
+# Function to compare two saved benchmark files run by run and stage by stage (best times). Stages at least
+# `threshold` times slower than in the baseline file are reported as regressions. Returns a DataFrame of all ratios.
+def compare_benchmarks(baseline_path, current_path, threshold=1.25):
+    rows = []
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+    with open(current_path) as handle:
+        current = json.load(handle)
+    baseline_runs = {(run['n_rows'], run['n_extra_scales']): run for run in baseline['runs']}
+    for run in current['runs']:
+        previous = baseline_runs.get((run['n_rows'], run['n_extra_scales']))
+        if previous is None:
+            continue
+        for name, timing in run['stages'].items():
+            if name not in previous['stages']:
+                continue
+            before = previous['stages'][name]['best']
+            rows.append({'n_rows': run['n_rows'], 'n_variables': run['n_variables'], 'stage': name,
+                         'baseline_seconds': before, 'current_seconds': timing['best'],
+                         'ratio': timing['best'] / before if before > 0 else np.nan})
+    comparison = pd.DataFrame(rows)
+    if len(comparison):
+        regressions = comparison[comparison['ratio'] >= threshold]
+        if len(regressions):
+            print(f"Regressions (at least {threshold:.2f}x slower):")
+            print(regressions.to_string(index=False))
+        else:
+            print("No regressions.")
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time every stage of the analysis scripts on synthetic study data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help='numbers of participants')
+    parser.add_argument('--extra-scales', type=int, nargs='+', default=[0],
+                        help='numbers of additional 0-6 scales per timepoint')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--format', default='svg', help='export format of the figures')
+    parser.add_argument('--dpi', type=int, default=1200)
+    parser.add_argument('--output-dir', default='benchmark_results')
+    parser.add_argument('--compare', help='earlier results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+    path = run_benchmarks(args.rows, args.extra_scales, repeats=args.repeats, output_dir=args.output_dir,
+                          export_format=args.format, dpi=args.dpi)
+    if args.compare:
+        compare_benchmarks(args.compare, path, threshold=args.threshold)
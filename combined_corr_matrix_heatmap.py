@@ -1,103 +1,56 @@
-# Import libraries: Pandas for data manipulation, Seaborn for heat map, matplotlib for displaying it.
-import pandas as pd
-import seaborn as sns
+# Import libraries: matplotlib for displaying the heat map (drawn with Seaborn through study_pipeline).
 import matplotlib.pyplot as plt
-import numpy as np
-from scipy.stats import spearmanr
-import shutil
+from condensed_matrix import adjust_condensed
+from figure_export import ExportQueue
+from stage_profiler import profiler
+from study_data_loader import load_study_frames, name_mapping
+# cached_condensed_corr is create_corr_matrix (Spearman matrices, optionally blocked, pairwise or with resampled
+# p-values) with an on-disk result cache, returning only the lower triangles; plot_heatmap is shared with the benchmark
+# suite.
+from result_cache import cached_condensed_corr
+from study_pipeline import plot_heatmap
 
 # Loading csv file here.
 from google.colab import drive
 drive.mount('/content/drive')
 
-# db stands for Database (shorthand)
-db = pd.read_csv('/content/drive/My Drive/Nick_Paper_Education_Exercise_Study_Data_for_Correlation.csv')
+# Loads the numeric baseline (ending in '1' and 'A1') and after education (ending in '5' and 'A2') data, excluding PainProblems1 /""5.
+# The shared loader caches the split data, so later runs skip parsing the CSV file.
+data_1, data_5 = load_study_frames('/content/drive/My Drive/Nick_Paper_Education_Exercise_Study_Data_for_Correlation.csv')
 
-# Reads numeric data only to avoid column and participant number.
-numeric_data = db.select_dtypes(include=['float64','int64'])
+# Create correlation matrices and p-values for data_1 and data_5. Results are cached in .result_cache by the content of
+# the data, so re-running to change titles or colors skips the computation. Only the lower triangle of each matrix (the
+# part the heatmaps show) is kept, and the variables are renamed.
+results_1 = cached_condensed_corr(data_1).rename(name_mapping)
+results_5 = cached_condensed_corr(data_5).rename(name_mapping)
 
-# Code to exclude specific columns: PainProblems1 /""5.
-exclude_columns = ['PainProblems1', 'PainProblems5']
-
-# Filtering data for variables ending in '1' and 'A1', excluding the specified columns when filtering. Baseline, prior to pain education.
-data_1 = numeric_data.filter(regex='1$|A1$').drop(columns=exclude_columns, errors='ignore')
-# Filter data for variables ending in '5' and 'A2', excluding the specified columns when filtering. This is after pain education.
-data_5 = numeric_data.filter(regex='5$|A2$').drop(columns=exclude_columns, errors='ignore')
-
-# Function to create a correlation matrix and calculate p-values.
-def create_corr_matrix(data):
-    # Calculates the correlation coefficients and p-values using vectorization.
-    corr, p_values = spearmanr(data, axis=0)
-    
-    # Converts the numpy arrays to pandas DataFrames
-    corr_matrix = pd.DataFrame(corr, index=data.columns, columns=data.columns)
-    p_values = pd.DataFrame(p_values, index=data.columns, columns=data.columns)
-    
-    return corr_matrix, p_values
-
-# Create correlation matrices and p-values for data_1 and data_5.
-corr_matrix_1, p_values_1 = create_corr_matrix(data_1)
-corr_matrix_5, p_values_5 = create_corr_matrix(data_5)
-
-# Rename the columns and index of the correlation matrix and p-values DataFrame.
-name_mapping = {
-    'PainDays1': 'Days Manageable Pain',
-    'InterfereActive1': 'Interference Activity',
-    'InterfereMood1' : 'Interference Mood',
-    'InterfereSleep1' : 'Interference Sleep',
-    'HowHard1' : 'Hard to Deal',
-
-    'PainDays5': 'Days Manageable Pain',
-    'InterfereActive5': 'Interference Activity',
-    'InterfereMood5': 'Interference Mood',
-    'InterfereSleep5': 'Interference Sleep',
-    'HowHard5': 'Hard to Deal',
-
-    'Scale1PSA1': 'Pain Severity',
-    'Scale2LIA1': 'Life Interference',
-    'Scale3LCA1': 'Life Control',
-    'Scale4ADA1': 'Affective Distress',
-    'Scale5SA1': 'Support',
-
-    'Scale1PSA2': 'Pain Severity',
-    'Scale2LIA2': 'Life Interference',
-    'Scale3LCA2': 'Life Control',
-    'Scale4ADA2': 'Affective Distress',
-    'Scale5SA2': 'Support'
-}
-
-corr_matrix_1.rename(columns=name_mapping, index=name_mapping, inplace=True)
-p_values_1.rename(columns=name_mapping, index=name_mapping, inplace=True)
-corr_matrix_5.rename(columns=name_mapping, index=name_mapping, inplace=True)
-p_values_5.rename(columns=name_mapping, index=name_mapping, inplace=True)
-
-# Function to create the heatmap from the correlation matrix. Heatmap will include p-values calculated above.
-def plot_heatmap(corr_matrix, p_values, title):
-    # The mask is to hide the top half of the heatmap correlations (above r = 1).
-    mask = np.triu(np.ones_like(corr_matrix, dtype=bool), k=1)
-    sns.heatmap(corr_matrix, annot=True, cmap='RdBu', fmt='.2f', mask=mask, cbar_kws={'label': 'Spearman Correlation'})
-    for i in range(len(corr_matrix.columns)):
-        for j in range(i):
-            p = p_values.iloc[i, j]
-            if p < 0.01:
-                plt.text(j + 0.5, i + 0.70, '**', ha='center', va='top', color='black')
-            elif p < 0.05:
-                plt.text(j + 0.5, i + 0.70, '*', ha='center', va='top', color='black')
-    plt.title(title)
+# Corrects the p-values of all pairs of both timepoints as one family before the significance stars are drawn:
+# 'fdr_bh' (Benjamini-Hochberg), 'holm' (Holm-Bonferroni), or None for the uncorrected p < 0.05 / p < 0.01 stars.
+p_adjust = 'fdr_bh'
+if p_adjust is not None:
+    adjust_condensed([results_1, results_5], p_adjust)
 
 # Plot heatmaps and save them to a single SVG file. The SVG file gives it a better resolution.
 plt.figure(figsize=(8, 12))
 
 plt.subplot(2, 1, 1)
-plot_heatmap(corr_matrix_1, p_values_1, 'Spearman Rho Correlation Matrix: Baseline')
+plot_heatmap(results_1, None, 'Spearman Rho Correlation Matrix: Baseline')
 
 plt.subplot(2, 1, 2)
-plot_heatmap(corr_matrix_5, p_values_5, 'Spearman Rho Correlation Matrix: After Education')
+plot_heatmap(results_5, None, 'Spearman Rho Correlation Matrix: After Education')
 
-# Format adjustment layout to prevent overlap between the subplots, saving figure as svg, and display preview of what the end product looks like.
+# Format adjustment layout to prevent overlap between the subplots, and display preview of what the end product looks like.
+# The figure is exported in the background straight into the Google Drive folder, in every format of export_formats
+# (e.g. ('svg', 'pdf', 'png')): each file is written under a temporary name and renamed once complete. The cells of
+# large heatmaps are rasterized while all text stays vector; the file sizes and render times are printed.
+export_formats = ('svg',)
 plt.tight_layout()
-plt.savefig('combined_correlation_heatmap.svg', dpi=1200)
-plt.show()
-
-# Moving the combined image to Google Drive.
-shutil.move('combined_correlation_heatmap.svg', '/content/drive/My Drive/Colab Notebooks/combined_correlation_heatmap.svg')
+with ExportQueue() as export_queue:
+    export_queue.submit(plt.gcf(), '/content/drive/My Drive/Colab Notebooks/combined_correlation_heatmap',
+                        formats=export_formats, dpi=1200)
+    plt.show()
+
+# Saves the wall/CPU time, memory use and file sizes of every stage of this run as a Chrome trace (open it in
+# chrome://tracing or Perfetto) and prints them as a table.
+profiler.save_trace('combined_corr_matrix_heatmap_trace.json')
+print(profiler.summary().to_string(index=False))
@@ -0,0 +1,146 @@
+# Condensed storage for correlation results. The correlation and p-value matrices are symmetric and the heatmaps only
+# show the lower triangle, so CondensedCorrelation keeps just the k(k-1)/2 pairs below the diagonal (in the row-major
+# order of np.tril_indices(k, -1)) plus the diagonal of the correlations: half the memory and half the bytes on disk
+# of two full k x k DataFrames. Renaming only touches the variable names. adjust_pvalues applies the
+# Benjamini-Hochberg or Holm correction to any number of p-values at once, and adjust_condensed corrects all pairs of
+# several matrices (e.g. both timepoints) as one family; the heatmap stars then use the adjusted p-values.
+import numpy as np
+import pandas as pd
+
+# Correction methods accepted by adjust_pvalues.
+p_adjust_methods = ('fdr_bh', 'holm')
+
+
+# Function returning the entries of a square matrix on and below diagonal offset k (k=-1: strictly below), row by row.
+def condense(matrix, k=-1):
+    matrix = np.asarray(matrix)
+    return matrix[np.tril_indices(matrix.shape[0], k)]
+
+
+# Function to rebuild the symmetric square matrix of n variables from the entries below the diagonal (k=-1, the
+# diagonal is set to `diagonal`) or on and below it (k=0).
+def expand(condensed, n, k=-1, diagonal=np.nan):
+    matrix = np.empty((n, n), dtype=np.result_type(condensed, np.float64))
+    if k == -1:
+        matrix[np.diag_indices(n)] = diagonal
+    rows, cols = np.tril_indices(n, k)
+    matrix[rows, cols] = condensed
+    matrix[cols, rows] = condensed
+    return matrix
+
+
+# Function to correct p-values for multiple comparisons in one vectorized pass. method is 'fdr_bh'
+# (Benjamini-Hochberg false discovery rate) or 'holm' (Holm-Bonferroni family-wise error). NaNs are left out of
+# the family and stay NaN. Gives the same values as statsmodels' multipletests and, for 'fdr_bh',
+# scipy.stats.false_discovery_control.
+def adjust_pvalues(p_values, method='fdr_bh'):
+    if method not in p_adjust_methods:
+        raise ValueError(f"Unknown p-value correction '{method}'; expected one of {p_adjust_methods}.")
+    p_values = np.asarray(p_values, dtype='float64')
+    adjusted = np.full(p_values.shape, np.nan)
+    observed = np.flatnonzero(~np.isnan(p_values.ravel()))
+    m = len(observed)
+    if m == 0:
+        return adjusted
+    order = np.argsort(p_values.ravel()[observed], kind='stable')
+    sorted_p = p_values.ravel()[observed][order]
+    if method == 'fdr_bh':
+        # p * m / rank, made monotone from the largest p-value down.
+        sorted_adjusted = np.minimum.accumulate((sorted_p * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        # p * (m - rank + 1), made monotone from the smallest p-value up.
+        sorted_adjusted = np.maximum.accumulate(sorted_p * np.arange(m, 0, -1))
+    adjusted.ravel()[observed[order]] = np.minimum(sorted_adjusted, 1.0)
+    return adjusted
+
+
+# Lower triangle of a correlation matrix and its p-values, with optional adjusted p-values.
+class CondensedCorrelation:
+    def __init__(self, variables, rho, p_values, diagonal, adjusted_p=None):
+        self.variables = pd.Index(variables)  # variable names, in matrix order
+        self.rho = rho                        # correlations below the diagonal, np.tril_indices(k, -1) order
+        self.p_values = p_values              # their p-values, same order
+        self.diagonal = diagonal              # diagonal of the correlation matrix (1, or NaN for unusable columns)
+        self.adjusted_p = adjusted_p          # corrected p-values once adjust_condensed has run, else None
+
+    # Function to build the condensed form from the (corr_matrix, p_values) pair returned by create_corr_matrix.
+    @classmethod
+    def from_matrices(cls, corr_matrix, p_values):
+        corr = np.asarray(corr_matrix, dtype='float64')
+        return cls(getattr(corr_matrix, 'columns', range(corr.shape[0])), condense(corr), condense(p_values),
+                   np.diagonal(corr).copy())
+
+    # Function returning a copy with renamed variables (a dict like name_mapping); the arrays are shared.
+    def rename(self, mapping):
+        return CondensedCorrelation(self.variables.map(lambda name: mapping.get(name, name)), self.rho,
+                                    self.p_values, self.diagonal, self.adjusted_p)
+
+    # Function returning the significance p-values: the adjusted ones when a correction was applied.
+    def significance_p(self):
+        return self.p_values if self.adjusted_p is None else self.adjusted_p
+
+    # Function returning (row, column) positions of the condensed pairs in the square matrix.
+    def pair_indices(self):
+        return np.tril_indices(len(self.variables), -1)
+
+    # Function to rebuild the full correlation matrix as a DataFrame, for plotting.
+    def corr_frame(self):
+        return pd.DataFrame(expand(self.rho, len(self.variables), diagonal=self.diagonal),
+                            index=self.variables, columns=self.variables)
+
+    # Function returning one row per pair: the two variables, rho, p and (if computed) the adjusted p.
+    def pairs(self):
+        rows, cols = self.pair_indices()
+        table = pd.DataFrame({'variable a': self.variables[rows], 'variable b': self.variables[cols],
+                              'rho': self.rho, 'p-value': self.p_values})
+        if self.adjusted_p is not None:
+            table['adjusted p-value'] = self.adjusted_p
+        return table
+
+    # Function to save the condensed arrays to an uncompressed .npz file.
+    def save(self, path):
+        arrays = {'variables': np.array([str(name) for name in self.variables]), 'rho': self.rho,
+                  'p_values': self.p_values, 'diagonal': self.diagonal}
+        if self.adjusted_p is not None:
+            arrays['adjusted_p'] = self.adjusted_p
+        with open(path, 'wb') as handle:
+            np.savez(handle, **arrays)
+
+    # Function to load a file written by save.
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as entry:
+            return cls(entry['variables'].tolist(), entry['rho'], entry['p_values'], entry['diagonal'],
+                       entry['adjusted_p'] if 'adjusted_p' in entry.files else None)
+
+
+# Function to correct the p-values of every pair of several condensed results as one family, e.g. both timepoints,
+# and store them as adjusted_p. Returns the results.
+def adjust_condensed(results, method='fdr_bh'):
+    adjusted = adjust_pvalues(np.concatenate([result.p_values for result in results]), method)
+    boundaries = np.cumsum([len(result.p_values) for result in results])[:-1]
+    for result, part in zip(results, np.split(adjusted, boundaries)):
+        result.adjusted_p = part
+    return results
+
+
+# Checks the corrections against scipy (Benjamini-Hochberg) and a plain loop (Holm), and the round trip of the
+# condensed form.
+if __name__ == '__main__':
+    from scipy.stats import false_discovery_control
+    rng = np.random.default_rng(0)
+    p = rng.uniform(size=500) ** 3
+    print('fdr_bh: max error vs scipy =', np.max(np.abs(adjust_pvalues(p) - false_discovery_control(p))))
+    holm = np.empty_like(p)
+    running = 0.0
+    for rank, index in enumerate(np.argsort(p)):
+        running = max(running, min(1.0, (len(p) - rank) * p[index]))
+        holm[index] = running
+    print('holm: max error vs loop =', np.max(np.abs(adjust_pvalues(p, 'holm') - holm)))
+
+    data = pd.DataFrame(rng.normal(size=(100, 30)), columns=[f'v{i}' for i in range(30)])
+    corr_matrix = data.corr(method='spearman')
+    condensed = CondensedCorrelation.from_matrices(corr_matrix, corr_matrix)
+    print('Round trip exact:', np.array_equal(condensed.corr_frame().to_numpy(), corr_matrix.to_numpy()),
+          f'({condensed.rho.nbytes + condensed.p_values.nbytes + condensed.diagonal.nbytes} bytes instead of '
+          f'{2 * corr_matrix.to_numpy().nbytes})')
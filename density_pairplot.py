@@ -0,0 +1,96 @@
+# Density pairplot for large cohorts. sns.pairplot scatters every participant in every panel, so its cost grows with
+# rows x columns^2 and it becomes unusable beyond a handful of columns or a few hundred thousand rows. pair_histograms
+# instead bins every column once and counts the 2-D histograms of all column pairs together, as one-hot matrix
+# products over blocks of rows; the diagonal blocks of the same product are the 1-D histograms. The pairplot then
+# draws one small mesh per panel, so drawing time depends on the number of bins, not rows.
+import numpy as np
+import pandas as pd
+
+
+# Function to draw a sample of n_samples rows stratified by the column (or Series) `strata`: every stratum keeps its
+# share of the rows. Without strata it is a simple random sample.
+def stratified_sample(data, n_samples, strata=None, seed=0):
+    if n_samples >= len(data):
+        return data
+    if strata is None:
+        return data.sample(n=n_samples, random_state=seed)
+    groups = data[strata] if isinstance(strata, str) else pd.Series(strata, index=data.index)
+    fraction = n_samples / len(data)
+    return data.groupby(groups, group_keys=False, dropna=False).sample(frac=fraction, random_state=seed)
+
+
+# Function to compute the bin edges of every column: `bins` equal-width bins over the observed range.
+def _bin_edges(values, bins):
+    with np.errstate(invalid='ignore'):
+        low = np.nanmin(values, axis=0, initial=np.inf, where=~np.isnan(values))
+        high = np.nanmax(values, axis=0, initial=-np.inf, where=~np.isnan(values))
+    low = np.where(np.isfinite(low), low, 0.0)
+    high = np.where(np.isfinite(high), high, 1.0)
+    # A constant column gets a unit-wide range centred on its value.
+    constant = high <= low
+    low, high = np.where(constant, low - 0.5, low), np.where(constant, high + 0.5, high)
+    return np.linspace(low, high, bins + 1).T
+
+
+# Function to compute the 2-D histograms of every pair of columns and the 1-D histogram of every column.
+# Missing values are left out pair by pair. Returns (counts, edges): counts has shape (k, bins, k, bins), with
+# counts[i, :, j, :] the histogram of column i (rows) against column j (columns), and edges has shape (k, bins + 1).
+def pair_histograms(data, bins=20, block_rows=65536):
+    values = np.asarray(data, dtype='float64')
+    n_rows, n_cols = values.shape
+    edges = _bin_edges(values, bins)
+    offsets = np.arange(n_cols) * bins
+    counts = np.zeros((n_cols * bins, n_cols * bins))
+    for start in range(0, n_rows, block_rows):
+        block = values[start:start + block_rows]
+        observed = ~np.isnan(block)
+        scaled = (block - edges[:, 0]) / (edges[:, -1] - edges[:, 0]) * bins
+        codes = np.clip(np.nan_to_num(scaled).astype(int), 0, bins - 1) + offsets
+        rows, cols = np.nonzero(observed)
+        one_hot = np.zeros((block.shape[0], n_cols * bins), dtype='float32')
+        one_hot[rows, codes[rows, cols]] = 1
+        counts += (one_hot.T @ one_hot).astype('float64')
+    return counts.reshape(n_cols, bins, n_cols, bins), edges
+
+
+# Function to draw a pairplot of all columns from their binned counts: 2-D histograms off the diagonal and 1-D
+# histograms on it. With n_samples, a (stratified) sample of that many rows is binned instead of all rows.
+# Colors use a logarithmic scale when log=True so that sparse regions stay visible next to dense ones.
+def plot_density_pairplot(data, bins=20, n_samples=None, strata=None, seed=0, log=True, cmap='viridis',
+                          color='#4E79A7', height=2.0):
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm, Normalize
+
+    if n_samples is not None:
+        data = stratified_sample(data, n_samples, strata=strata, seed=seed)
+        if isinstance(strata, str) and strata in data.columns:
+            data = data.drop(columns=strata)
+    columns = list(data.columns)
+    counts, edges = pair_histograms(data, bins=bins)
+    n_cols = len(columns)
+
+    off_diagonal = counts.transpose(0, 2, 1, 3)[~np.eye(n_cols, dtype=bool)] if n_cols > 1 else np.zeros(1)
+    vmax = max(off_diagonal.max(), 1)
+    norm = LogNorm(vmin=1, vmax=vmax) if log else Normalize(vmin=0, vmax=vmax)
+    fig, axes = plt.subplots(n_cols, n_cols, figsize=(height * n_cols, height * n_cols), squeeze=False,
+                             sharex='col')
+    mesh = None
+    for i in range(n_cols):
+        for j in range(n_cols):
+            ax = axes[i, j]
+            if i == j:
+                ax.stairs(counts[i, :, i, :].diagonal(), edges[i], fill=True, color=color, edgecolor='black')
+            else:
+                # counts[j, :, i, :] has column j along its rows, so transposing puts column i on the y axis.
+                panel = counts[j, :, i, :].T
+                mesh = ax.pcolormesh(edges[j], edges[i], np.ma.masked_less(panel, 1) if log else panel,
+                                     cmap=cmap, norm=norm)
+            if i == n_cols - 1:
+                ax.set_xlabel(columns[j])
+            if j == 0 and i != 0:
+                ax.set_ylabel(columns[i])
+            elif j != i:
+                ax.tick_params(labelleft=False)
+    if mesh is not None:
+        fig.colorbar(mesh, ax=axes, shrink=0.6, label='Participants')
+    return fig
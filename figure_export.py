@@ -0,0 +1,164 @@
+# Figure export helpers. Dense heatmaps saved as SVG at dpi=1200 contain one vector path per cell, which makes the
+# files huge and slow to write and open. export_figure rasterizes large heatmap meshes (at the figure's dpi) while
+# text, axes and colorbar labels stay vector, and reports file size and render time. Small meshes stay vector: a
+# 1200 dpi image of a 10-variable heatmap is larger and slower to write than its few hundred paths, and rasterizing
+# only pays off from about rasterize_min_cells cells (some 100-150 variables). render_figures_parallel renders
+# independent figures in worker processes on the headless Agg backend. ExportQueue takes finished figures and writes
+# them in background worker processes, in several formats, while the script carries on with the next statistics.
+# Every file is written under a temporary name in its destination folder and then renamed, so a failed or interrupted
+# export never leaves a partial file behind.
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from stage_profiler import profile_stage, profiled_stage, profiler
+
+# Number of cells from which rasterize='auto' rasterizes a heatmap mesh.
+rasterize_min_cells = 10_000
+
+
+# Function to rasterize the heatmap meshes of a figure; text, axes and colorbar labels stay vector. rasterize is True
+# (every mesh), False (none) or 'auto' (meshes of at least rasterize_min_cells cells).
+def _rasterize_meshes(fig, rasterize='auto'):
+    from matplotlib.collections import QuadMesh
+    if rasterize is False:
+        return
+    for ax in fig.axes:
+        for collection in ax.collections:
+            if isinstance(collection, QuadMesh) and (rasterize is True
+                                                     or collection.get_array().size >= rasterize_min_cells):
+                collection.set_rasterized(True)
+
+
+# Function to save a figure to a temporary file next to filename and rename it into place once it is complete.
+# The format comes from savefig_kwargs['format'] or the file extension. Returns the seconds taken.
+def _atomic_savefig(fig, filename, dpi, **savefig_kwargs):
+    directory, name = os.path.split(os.path.abspath(filename))
+    savefig_kwargs.setdefault('format', os.path.splitext(name)[1][1:] or None)
+    temporary_path = os.path.join(directory, f'.{name}.{os.getpid()}.tmp')
+    start = time.perf_counter()
+    try:
+        fig.savefig(temporary_path, dpi=dpi, **savefig_kwargs)
+        os.replace(temporary_path, filename)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    return time.perf_counter() - start
+
+
+# Function to save a figure, rasterizing large heatmap meshes (see _rasterize_meshes), and report its size and render
+# time. Extra keyword arguments (e.g. bbox_inches='tight') are passed to savefig.
+@profiled_stage('export_figure')
+def export_figure(fig, filename, dpi=1200, rasterize='auto', **savefig_kwargs):
+    _rasterize_meshes(fig, rasterize)
+    seconds = _atomic_savefig(fig, filename, dpi, **savefig_kwargs)
+    size = os.path.getsize(filename)
+    profiler.record_artifact(filename)
+    print(f"Saved {filename}: {size / 1024:,.1f} KiB in {seconds:.2f} s")
+    return {'filename': filename, 'bytes': size, 'seconds': seconds}
+
+
+# Function run once in every worker process: switches matplotlib to the headless Agg backend.
+def _use_agg_backend():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+# Function to call one render job and time it from start (building the figure) to finish (file written).
+def _run_render_job(job):
+    render_function, kwargs = job
+    start = time.perf_counter()
+    report = render_function(**kwargs)
+    report['render_seconds'] = time.perf_counter() - start
+    return report
+
+
+# Function to render independent figures in parallel. Each job is (render_function, kwargs), where the function is
+# defined at module level, builds and saves its own figure, and returns the report from export_figure.
+def render_figures_parallel(jobs, max_workers=None):
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(jobs), os.cpu_count() or 1),
+                             initializer=_use_agg_backend) as pool:
+        reports = list(pool.map(_run_render_job, jobs))
+    for report in reports:
+        print(f"Rendered {report['filename']}: {report['bytes'] / 1024:,.1f} KiB, "
+              f"{report['render_seconds']:.2f} s including figure construction")
+    return reports
+
+
+# Function run in an export worker: rebuilds the pickled figure and writes it to every (filename, dpi) target.
+def _write_figure_files(figure_bytes, targets, rasterize, savefig_kwargs):
+    import matplotlib.pyplot as plt
+    fig = pickle.loads(figure_bytes)
+    _rasterize_meshes(fig, rasterize)
+    reports = []
+    try:
+        for filename, dpi in targets:
+            seconds = _atomic_savefig(fig, filename, dpi, **savefig_kwargs)
+            reports.append({'filename': filename, 'bytes': os.path.getsize(filename), 'seconds': seconds})
+    finally:
+        plt.close(fig)
+    return reports
+
+
+# Queue of figure exports written by background worker processes. submit() takes a snapshot of a finished figure
+# (it is pickled, so the figure can be shown, changed or closed right away) and returns at once; wait() blocks until
+# every submitted file is written. Use it as a context manager to wait and shut the workers down at the end.
+class ExportQueue:
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._pool = None
+        self._pending = []
+
+    # Function to queue a figure for export to destination (a path without extension) in every format of formats.
+    # dpi is one value or a dict per format, e.g. {'png': 300, 'svg': 1200}; extra keyword arguments (e.g.
+    # bbox_inches='tight') are passed to savefig, rasterize to _rasterize_meshes. close=True closes the figure once it
+    # is queued.
+    def submit(self, fig, destination, formats=('svg',), dpi=1200, rasterize='auto', close=False, **savefig_kwargs):
+        targets = [(f'{destination}.{fmt}', dpi.get(fmt, 1200) if isinstance(dpi, dict) else dpi) for fmt in formats]
+        os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+        figure_bytes = pickle.dumps(fig)
+        if close:
+            import matplotlib.pyplot as plt
+            plt.close(fig)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_use_agg_backend)
+        future = self._pool.submit(_write_figure_files, figure_bytes, targets, rasterize, savefig_kwargs)
+        self._pending.append((targets, future))
+        return future
+
+    # Function to wait for every queued export. Prints and returns the reports of the written files; if any export
+    # failed, the first error is raised after all the others have finished.
+    def wait(self):
+        reports = []
+        errors = []
+        with profile_stage('wait_for_exports', n_jobs=len(self._pending)):
+            for targets, future in self._pending:
+                try:
+                    reports.extend(future.result())
+                except Exception as e:
+                    print(f"Export of {', '.join(filename for filename, _ in targets)} failed: {e}")
+                    errors.append(e)
+            for report in reports:
+                profiler.record_artifact(report['filename'])
+                print(f"Saved {report['filename']}: {report['bytes'] / 1024:,.1f} KiB in {report['seconds']:.2f} s")
+        self._pending = []
+        if errors:
+            raise errors[0]
+        return reports
+
+    # Function to wait for the queued exports and stop the worker processes.
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,140 @@
+# Grouped analysis: the Spearman matrices of both timepoints and the Wilcoxon comparison computed separately for
+# every group of a categorical column (site, sex, arm, ...), instead of one full script run per subgroup. The rows
+# are sorted by group once, so every group is a consecutive block of rows; all groups are then ranked in a single
+# sort (rank_utils.average_ranks with segment_starts), and each group's correlations are one matrix product of its
+# block of standardized ranks. The Wilcoxon tests run per group because the exact and sign-flip p-values depend on
+# the group size, each one batched over all variables. The results are stacked DataFrames indexed by group first.
+import numpy as np
+import pandas as pd
+
+import study_data_loader
+from correlation_engine import spearman_pvalues
+from rank_utils import average_ranks
+from study_data_loader import split_timepoints
+from wilcoxon_engine import wilcoxon_table
+
+
+# Function to sort the rows by group once. group_by is a column name or a list of column names; rows with a missing
+# group value are dropped. Returns the sorted data, the group labels (an Index, or a MultiIndex for several columns)
+# and the first row of every group.
+def sort_by_group(data, group_by):
+    if isinstance(group_by, str):
+        codes, labels = pd.factorize(data[group_by], sort=True)
+        labels = pd.Index(labels, name=group_by)
+    else:
+        keys = data[list(group_by)]
+        codes, labels = pd.MultiIndex.from_frame(keys).factorize(sort=True)
+        codes[keys.isna().any(axis=1).to_numpy()] = -1
+        labels = labels.set_names(list(group_by))
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    sorted_codes = codes[order]
+    present = np.unique(sorted_codes)
+    group_starts = np.searchsorted(sorted_codes, present)
+    return data.iloc[order].reset_index(drop=True), labels[present], group_starts
+
+
+# Function to compute the Spearman correlation and p-value matrices of every group from one segmented ranking.
+# Same results as scipy.stats.spearmanr on each group's rows: a column with missing values or no variation within a
+# group comes back as NaN for that group. Returns two arrays of shape (groups, columns, columns).
+def grouped_spearman(values, group_starts):
+    values = np.asarray(values, dtype='float64')
+    n_rows, n_cols = values.shape
+    group_stops = np.append(group_starts[1:], n_rows)
+    sizes = group_stops - group_starts
+
+    # Centres and scales every group's ranks at once, so each group's correlations are a plain matrix product.
+    ranks = average_ranks(values, segment_starts=group_starts)
+    means = np.add.reduceat(ranks, group_starts, axis=0) / sizes[:, None]
+    ranks -= np.repeat(means, sizes, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ranks /= np.repeat(np.sqrt(np.add.reduceat(ranks ** 2, group_starts, axis=0)), sizes, axis=0)
+
+    corr = np.empty((len(group_starts), n_cols, n_cols))
+    for group, (start, stop) in enumerate(zip(group_starts, group_stops)):
+        corr[group] = np.clip(ranks[start:stop].T @ ranks[start:stop], -1.0, 1.0)
+    diagonal = np.arange(n_cols)
+    defined = ~np.isnan(corr[:, diagonal, diagonal])
+    corr[:, diagonal, diagonal] = np.where(defined, 1.0, np.nan)
+    p_values = spearman_pvalues(corr, sizes[:, None, None])
+    p_values[:, diagonal, diagonal] = np.where(defined, 0.0, np.nan)
+    return corr, p_values
+
+
+# Function to stack per-group (columns x columns) matrices into one DataFrame indexed by (group, variable).
+def _stack_matrices(matrices, labels, columns):
+    index = pd.MultiIndex.from_tuples(
+        [(*(label if isinstance(label, tuple) else (label,)), col) for label in labels for col in columns],
+        names=[*labels.names, 'variable'])
+    return pd.DataFrame(matrices.reshape(-1, len(columns)), index=index, columns=columns)
+
+
+# Function to run the correlations and Wilcoxon comparison of every group. Groups with fewer than min_size
+# participants are left out; ValueError is raised when that leaves no group. Returns a dict of DataFrames: 'n' (participants per group), 'rho_baseline',
+# 'p_baseline', 'rho_after_education', 'p_after_education' (rows indexed by group and variable) and 'wilcoxon'
+# (the columns of wilcoxon_table, indexed by group and variable).
+def grouped_analysis(data, group_by, min_size=3, exclude_columns=study_data_loader.exclude_columns,
+                     baseline_regex=study_data_loader.baseline_regex, post_regex=study_data_loader.post_regex,
+                     name_mapping=study_data_loader.name_mapping):
+    sorted_data, labels, group_starts = sort_by_group(data, group_by)
+    group_columns = [group_by] if isinstance(group_by, str) else list(group_by)
+    data_1, data_5 = split_timepoints(sorted_data.drop(columns=group_columns), exclude_columns, baseline_regex,
+                                      post_regex)
+    data_1 = data_1.rename(columns=name_mapping)
+    data_5 = data_5.rename(columns=name_mapping)
+
+    sizes = np.diff(np.append(group_starts, len(sorted_data)))
+    keep = sizes >= min_size
+    if not keep.any():
+        raise ValueError(f"No group of '{group_by}' has at least min_size={min_size} participants "
+                         f"(largest group: {sizes.max(initial=0)}).")
+    rows = np.concatenate([np.arange(start, start + size) for start, size in zip(group_starts[keep], sizes[keep])]
+                          + [np.empty(0, dtype='int64')])
+    labels, sizes = labels[keep], sizes[keep]
+    group_starts = np.append(0, np.cumsum(sizes)[:-1])
+    data_1, data_5 = data_1.iloc[rows], data_5.iloc[rows]
+
+    results = {'n': pd.Series(sizes, index=labels, name='n')}
+    for frame, label in ((data_1, 'baseline'), (data_5, 'after_education')):
+        corr, p_values = grouped_spearman(frame.to_numpy(dtype='float64'), group_starts)
+        results[f'rho_{label}'] = _stack_matrices(corr, labels, frame.columns)
+        results[f'p_{label}'] = _stack_matrices(p_values, labels, frame.columns)
+    results['wilcoxon'] = pd.concat(
+        [wilcoxon_table(data_1.iloc[start:start + size], data_5.iloc[start:start + size])
+         for start, size in zip(group_starts, sizes)],
+        keys=list(labels), names=[*labels.names, 'variable'])
+    return results
+
+
+# Function to check the grouped results against one create_corr_matrix and wilcoxon_table run per group.
+# Returns the largest absolute differences of the correlations, their p-values and the Wilcoxon p-values.
+def check_against_subsets(data, group_by, min_size=3):
+    from study_pipeline import create_corr_matrix
+    results = grouped_analysis(data, group_by, min_size=min_size)
+    errors = np.zeros(3)
+    for label, subset in data.groupby(group_by, sort=True):
+        if len(subset) < min_size:
+            continue
+        data_1, data_5 = split_timepoints(subset.drop(columns=group_by))
+        data_1 = data_1.rename(columns=study_data_loader.name_mapping)
+        data_5 = data_5.rename(columns=study_data_loader.name_mapping)
+        corr_matrix, p_values = create_corr_matrix(data_1)
+        reference = wilcoxon_table(data_1, data_5)
+        differences = [results['rho_baseline'].loc[label].to_numpy() - corr_matrix.to_numpy(),
+                       results['p_baseline'].loc[label].to_numpy() - p_values.to_numpy(),
+                       results['wilcoxon'].loc[label, 'p-value'].to_numpy() - reference['p-value'].to_numpy()]
+        errors = np.maximum(errors, [np.nanmax(np.abs(difference), initial=0) for difference in differences])
+    return tuple(errors)
+
+
+# Compares the grouped results with one run per group on synthetic data split into 12 sites of different sizes.
+if __name__ == '__main__':
+    import warnings
+
+    from benchmark_suite import synthetic_study_data
+    rng = np.random.default_rng(0)
+    data = synthetic_study_data(2000, missing_rate=0.0)
+    data['Site'] = rng.choice([f'site{i:02d}' for i in range(12)], size=len(data), p=np.linspace(1, 3, 12) / 24)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        print('Max |rho|, |p|, |Wilcoxon p| error =', check_against_subsets(data, 'Site'))
@@ -0,0 +1,66 @@
+# Shared helpers for the Spearman correlation heatmaps.
+# matplotlib and seaborn are imported inside the plotting functions, so significance_labels can be used without them.
+import numpy as np
+
+from condensed_matrix import CondensedCorrelation
+from figure_export import export_figure
+from stage_profiler import profiled_stage
+
+
+# Function to build the heatmap cell labels in one vectorized pass: each correlation formatted with two decimals,
+# followed on a new line by '**' when p < 0.01 or '*' when p < 0.05. Only the lower triangle (below the diagonal)
+# gets significance markers, as the upper triangle is masked in the heatmap. Passing the result as seaborn's annot
+# (with fmt='') draws the markers together with the numbers instead of adding one text artist per star.
+# corr_matrix can also be a CondensedCorrelation (p_values is then ignored): the stars are read from its condensed
+# pairs, using the adjusted p-values when a correction was applied, so the corrected thresholds replace raw p < 0.05.
+@profiled_stage('significance_labels')
+def significance_labels(corr_matrix, p_values=None, fmt='%.2f'):
+    if isinstance(corr_matrix, CondensedCorrelation):
+        rows, cols = corr_matrix.pair_indices()
+        p = corr_matrix.significance_p()
+        stars = np.full((len(corr_matrix.variables),) * 2, '', dtype='<U3')
+        stars[rows, cols] = np.where(p < 0.01, '\n**', np.where(p < 0.05, '\n*', ''))
+        return np.char.add(np.char.mod(fmt, corr_matrix.corr_frame().to_numpy()), stars)
+    corr = np.asarray(corr_matrix, dtype='float64')
+    p = np.asarray(p_values, dtype='float64')
+    lower = np.tril(np.ones(corr.shape, dtype=bool), k=-1)
+    stars = np.where(lower & (p < 0.01), '\n**', np.where(lower & (p < 0.05), '\n*', ''))
+    return np.char.add(np.char.mod(fmt, corr), stars)
+
+
+# Function returning the square correlation DataFrame to draw, for a DataFrame or a CondensedCorrelation.
+def heatmap_matrix(corr_matrix):
+    if isinstance(corr_matrix, CondensedCorrelation):
+        return corr_matrix.corr_frame()
+    return corr_matrix
+
+
+# Function to draw one heatmap and save it: the only heatmap drawing code, shared by the scripts,
+# study_pipeline.plot_heatmap and the worker processes of figure_export.render_figures_parallel.
+# corr_matrix can be a CondensedCorrelation, with p_values=None. figsize=None draws on the current axes (e.g. a
+# subplot) instead of a new figure. With filename=None the figure is only drawn and returned; with export_queue it is
+# submitted to that figure_export.ExportQueue in every format of formats and left open, e.g. to be shown; otherwise it
+# is written with export_figure and closed, and the export report is returned.
+@profiled_stage('render_heatmap_file')
+def render_heatmap_file(corr_matrix, p_values, title, filename=None, figsize=(8, 5), dpi=1200, rasterize='auto',
+                        export_queue=None, formats=('svg',)):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    # Labels for every cell at once: the correlation, with ** underneath when p < 0.01 and * when p < 0.05.
+    labels = significance_labels(corr_matrix, p_values)
+    corr_matrix = heatmap_matrix(corr_matrix)
+    # The mask is to hide the top half of the heatmap correlations (above r = 1).
+    mask = np.triu(np.ones_like(corr_matrix, dtype=bool), k=1)
+    fig = plt.gcf() if figsize is None else plt.figure(figsize=figsize)
+    sns.heatmap(corr_matrix, annot=labels, cmap='RdBu', fmt='', mask=mask, cbar_kws={'label': 'Spearman Correlation'})
+    plt.title(title)
+    if filename is None:
+        return fig
+    # Saved tight to fit within the window in Word; the cell mesh of large heatmaps is rasterized so the files stay
+    # small, while the text stays vector.
+    if export_queue is not None:
+        export_queue.submit(fig, filename, formats=formats, dpi=dpi, rasterize=rasterize, bbox_inches='tight')
+        return fig
+    report = export_figure(fig, filename, dpi=dpi, rasterize=rasterize, bbox_inches='tight')
+    plt.close(fig)
+    return report
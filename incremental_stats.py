@@ -0,0 +1,297 @@
+# Incremental statistics for ongoing enrollment. Instead of rerunning every script on the whole CSV each time
+# participants are added, IncrementalStudyStats keeps a small state that each new batch of rows updates in time
+# proportional to the batch:
+#   - running moments (Welford, merged batch by batch) for means_1/means_5 and std_devs_1/std_devs_5,
+#   - per-level and joint level counts of every ordinal column, enough to rebuild the pairwise-complete Spearman
+#     matrices and the describe() quartiles exactly,
+#   - histograms of the paired differences, enough to rebuild the Wilcoxon signed-rank tests exactly.
+# Rank-based statistics can only be kept this way for ordinal data (Likert items, day counts); a column with more
+# than max_levels distinct values raises ValueError, and those statistics then need a full recompute.
+# The state also records the index labels of the rows it holds (the CSV row numbers for frames from
+# study_data_loader), so a batch with rows already in it is rejected instead of being counted twice; append_csv reads
+# only the rows of the CSV after the ones already absorbed.
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import study_data_loader
+from correlation_engine import level_cross_sums, level_midranks, spearman_from_rank_sums
+from wilcoxon_engine import batched_wilcoxon, exact_max_pairs
+
+
+# Running count, mean and sum of squared deviations per column, ignoring NaNs like pandas does.
+class RunningMoments:
+    def __init__(self, n_cols):
+        self.count = np.zeros(n_cols)
+        self.mean = np.zeros(n_cols)
+        self.m2 = np.zeros(n_cols)
+
+    # Merges the moments of a batch into the running ones (Chan et al.'s pairwise form of Welford's update).
+    def update(self, values):
+        observed = ~np.isnan(values)
+        batch_count = observed.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            batch_mean = np.where(batch_count > 0, np.nansum(values, axis=0) / batch_count, 0.0)
+        batch_m2 = np.nansum((values - batch_mean) ** 2, axis=0)
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.mean = np.where(total > 0, self.mean + delta * batch_count / total, 0.0)
+            self.m2 = np.where(total > 0, self.m2 + batch_m2 + delta ** 2 * self.count * batch_count / total, 0.0)
+        self.count = total
+
+    def means(self):
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def std_devs(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+
+# Level counts of ordinal columns: the distinct values of every column, how often each level occurs among the rows
+# observed in each other column, and how often each pair of levels occurs together.
+class _LevelCounts:
+    def __init__(self, n_cols, max_levels):
+        self.max_levels = max_levels
+        self.levels = [np.empty(0) for _ in range(n_cols)]
+        self.counts = np.zeros((0, n_cols))
+        self.joint = np.zeros((0, 0))
+        self.n_pairs = np.zeros((n_cols, n_cols))
+
+    def level_columns(self):
+        return np.concatenate([np.full(len(levels), col) for col, levels in enumerate(self.levels)]).astype(int)
+
+    def _offsets(self):
+        return np.concatenate([[0], np.cumsum([len(levels) for levels in self.levels])])
+
+    # Function returning the levels of every column once this batch is added. Raises ValueError, without changing
+    # anything, when a column would have more than max_levels distinct values.
+    def check(self, values):
+        observed = ~np.isnan(values)
+        new_levels = [np.union1d(levels, values[observed[:, col], col]) for col, levels in enumerate(self.levels)]
+        for col, levels in enumerate(new_levels):
+            if len(levels) > self.max_levels:
+                raise ValueError(f"Column {col} has more than {self.max_levels} distinct values; "
+                                 "its rank-based statistics need a full recompute.")
+        return new_levels
+
+    # Adds the levels first seen in this batch, moving the existing counts to their new positions.
+    def _add_levels(self, values):
+        new_levels = self.check(values)
+        if all(len(new) == len(old) for new, old in zip(new_levels, self.levels)):
+            return
+        offsets = np.concatenate([[0], np.cumsum([len(levels) for levels in new_levels])])
+        old_positions = np.concatenate([
+            offsets[col] + np.searchsorted(new_levels[col], old) for col, old in enumerate(self.levels)]).astype(int)
+        counts = np.zeros((offsets[-1], self.counts.shape[1]))
+        counts[old_positions] = self.counts
+        joint = np.zeros((offsets[-1], offsets[-1]))
+        joint[np.ix_(old_positions, old_positions)] = self.joint
+        self.levels, self.counts, self.joint = new_levels, counts, joint
+
+    def update(self, values):
+        self._add_levels(values)
+        observed = ~np.isnan(values)
+        offsets = self._offsets()
+        one_hot = np.zeros((values.shape[0], offsets[-1]))
+        for col, levels in enumerate(self.levels):
+            rows = np.flatnonzero(observed[:, col])
+            one_hot[rows, offsets[col] + np.searchsorted(levels, values[rows, col])] = 1
+        observed = observed.astype('float64')
+        self.counts += one_hot.T @ observed
+        self.joint += one_hot.T @ one_hot
+        self.n_pairs += observed.T @ observed
+
+    # Pairwise-complete Spearman correlations and p-values, identical to correlation_engine.pairwise_spearman
+    # (and to spearmanr when nothing is missing) on all rows seen so far.
+    def spearman(self):
+        level_columns = self.level_columns()
+        midranks, membership, squares = level_midranks(self.counts, level_columns)
+        n_cols = len(self.levels)
+        cross = level_cross_sums(midranks, membership, level_columns, self.joint,
+                                 slice(0, len(level_columns)), slice(0, n_cols))
+        return spearman_from_rank_sums(cross, squares, self.n_pairs.copy())
+
+    # Minimum, quartiles and maximum of every column, interpolated like pandas' describe().
+    def quantiles(self, qs=(0.0, 0.25, 0.5, 0.75, 1.0)):
+        offsets = self._offsets()
+        frequencies = np.diag(self.joint)
+        results = np.full((len(qs), len(self.levels)), np.nan)
+        for col, levels in enumerate(self.levels):
+            cumulative = np.cumsum(frequencies[offsets[col]:offsets[col + 1]])
+            if len(levels) == 0:
+                continue
+            position = np.asarray(qs) * (cumulative[-1] - 1)
+            lower = levels[np.searchsorted(cumulative, np.floor(position), side='right')]
+            upper = levels[np.searchsorted(cumulative, np.ceil(position), side='right')]
+            results[:, col] = lower + (position - np.floor(position)) * (upper - lower)
+        return results
+
+
+# Histograms of the paired differences (baseline minus after education) of every variable.
+class _DifferenceCounts:
+    def __init__(self, n_cols):
+        self.values = [np.empty(0) for _ in range(n_cols)]
+        self.counts = [np.empty(0) for _ in range(n_cols)]
+        self.has_nan = np.zeros(n_cols, dtype=bool)
+        self.n_rows = 0
+
+    def update(self, differences):
+        self.has_nan |= np.isnan(differences).any(axis=0)
+        self.n_rows += differences.shape[0]
+        for col in range(differences.shape[1]):
+            column = differences[:, col]
+            merged, inverse = np.unique(np.concatenate([self.values[col], column[~np.isnan(column)]]),
+                                        return_inverse=True)
+            weights = np.concatenate([self.counts[col], np.ones(np.count_nonzero(~np.isnan(column)))])
+            self.values[col], self.counts[col] = merged, np.bincount(inverse, weights=weights)
+
+    # Wilcoxon signed-rank tests, identical to wilcoxon_engine.batched_wilcoxon on all pairs seen so far.
+    # Small samples are rebuilt from the histograms for the exact p-values; larger ones are scored from them directly.
+    def wilcoxon(self):
+        from scipy.special import ndtr
+        n_cols = len(self.values)
+        if self.n_rows <= exact_max_pairs:
+            differences = np.column_stack([
+                np.full(self.n_rows, np.nan) if self.has_nan[col] else np.repeat(self.values[col],
+                                                                                 self.counts[col].astype(int))
+                for col in range(n_cols)])
+            return batched_wilcoxon(differences, np.zeros_like(differences))
+
+        results = {name: np.full(n_cols, np.nan) for name in ('statistic', 'zstatistic', 'pvalue', 'effect_size', 'n')}
+        for col in range(n_cols):
+            if self.has_nan[col]:
+                continue
+            values, counts = self.values[col], self.counts[col]
+            nonzero = values != 0
+            magnitudes, inverse = np.unique(np.abs(values[nonzero]), return_inverse=True)
+            positive = np.bincount(inverse, weights=counts[nonzero] * (values[nonzero] > 0), minlength=len(magnitudes))
+            negative = np.bincount(inverse, weights=counts[nonzero] * (values[nonzero] < 0), minlength=len(magnitudes))
+            ties = positive + negative
+            midranks = np.cumsum(ties) - ties + (ties + 1) / 2
+            count = ties.sum()
+            r_plus, r_minus = np.sum(midranks * positive), np.sum(midranks * negative)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                se = np.sqrt((count * (count + 1) * (2 * count + 1) - np.sum(ties ** 3 - ties) / 2) / 24)
+                z = (r_plus - count * (count + 1) * 0.25) / se
+                results['effect_size'][col] = z / np.sqrt(count)
+            results['statistic'][col] = min(r_plus, r_minus)
+            results['zstatistic'][col] = z
+            results['pvalue'][col] = 2 * ndtr(-abs(z))
+            results['n'][col] = count
+        return results
+
+
+# State store for the baseline (data_1) and after education (data_5) frames. data_5 must list the same variables in
+# the same order as data_1, as produced by study_data_loader.split_timepoints; later batches must have the same columns.
+# Rows are identified by their index labels, which must be the same in data_1 and data_5.
+class IncrementalStudyStats:
+    def __init__(self, data_1, data_5, max_levels=64):
+        self.columns_1 = data_1.columns
+        self.columns_5 = data_5.columns
+        self.row_labels = pd.Index([])
+        self.moments_1 = RunningMoments(len(self.columns_1))
+        self.moments_5 = RunningMoments(len(self.columns_5))
+        self.levels_1 = _LevelCounts(len(self.columns_1), max_levels)
+        self.levels_5 = _LevelCounts(len(self.columns_5), max_levels)
+        self.differences = _DifferenceCounts(len(self.columns_1))
+        self.append(data_1, data_5)
+
+    # Number of rows absorbed so far.
+    @property
+    def n_rows(self):
+        return len(self.row_labels)
+
+    # Function to add a batch of newly enrolled participants. A batch with too many distinct levels, or with rows
+    # whose index labels are already in the state (or repeated within the batch), raises ValueError before any part of
+    # the state is updated, so the store stays consistent and can still take other batches.
+    def append(self, data_1, data_5):
+        if not data_1.index.equals(data_5.index):
+            raise ValueError("data_1 and data_5 must have the same index (one row per participant).")
+        if data_1.index.has_duplicates:
+            raise ValueError("The batch lists the same row more than once.")
+        overlap = data_1.index.intersection(self.row_labels)
+        if len(overlap):
+            raise ValueError(f"{len(overlap)} rows of the batch are already in the state (first: {overlap[0]!r}); "
+                             "appending them again would count them twice.")
+        values_1 = data_1[self.columns_1].to_numpy(dtype='float64')
+        values_5 = data_5[self.columns_5].to_numpy(dtype='float64')
+        self.levels_1.check(values_1)
+        self.levels_5.check(values_5)
+        self.moments_1.update(values_1)
+        self.moments_5.update(values_5)
+        self.levels_1.update(values_1)
+        self.levels_5.update(values_5)
+        self.differences.update(values_1 - values_5)
+        self.row_labels = self.row_labels.append(data_1.index)
+
+    # Function to add the rows of the study CSV after the ones already absorbed, for a state built from the first
+    # n_rows rows of the same file (e.g. from study_data_loader.load_study_frames). Only the new rows are parsed; they
+    # get the CSV row numbers as index labels. name_mapping renames the columns like the state's were renamed.
+    # Returns the number of rows added.
+    def append_csv(self, csv_path, exclude_columns=study_data_loader.exclude_columns, name_mapping=None):
+        new_rows = pd.read_csv(csv_path, skiprows=range(1, self.n_rows + 1))
+        if new_rows.empty:
+            return 0
+        new_rows.index = pd.RangeIndex(self.n_rows, self.n_rows + len(new_rows))
+        data_1, data_5 = study_data_loader.split_timepoints(new_rows, exclude_columns)
+        if name_mapping is not None:
+            data_1 = data_1.rename(columns=name_mapping)
+            data_5 = data_5.rename(columns=name_mapping)
+        self.append(data_1, data_5)
+        return len(new_rows)
+
+    @property
+    def means_1(self):
+        return pd.Series(self.moments_1.means(), index=self.columns_1)
+
+    @property
+    def means_5(self):
+        return pd.Series(self.moments_5.means(), index=self.columns_5)
+
+    @property
+    def std_devs_1(self):
+        return pd.Series(self.moments_1.std_devs(), index=self.columns_1)
+
+    @property
+    def std_devs_5(self):
+        return pd.Series(self.moments_5.std_devs(), index=self.columns_5)
+
+    # Function returning corr_matrix_1, p_values_1, corr_matrix_5, p_values_5 as DataFrames.
+    def corr_matrices(self):
+        matrices = []
+        for levels, columns in ((self.levels_1, self.columns_1), (self.levels_5, self.columns_5)):
+            corr, p_values = levels.spearman()
+            matrices += [pd.DataFrame(corr, index=columns, columns=columns),
+                         pd.DataFrame(p_values, index=columns, columns=columns)]
+        return tuple(matrices)
+
+    # Function returning the same table as wilcoxon_engine.wilcoxon_table, indexed by the baseline columns.
+    def wilcoxon_table(self):
+        results = self.differences.wilcoxon()
+        return pd.DataFrame({
+            'statistic': results['statistic'],
+            'z-score': results['zstatistic'],
+            'p-value': results['pvalue'],
+            'effect size': results['effect_size'],
+            'n': results['n'],
+        }, index=self.columns_1)
+
+    # Function returning the same summary as DataFrame.describe() for the baseline (timepoint=1) or post (5) frame.
+    def describe(self, timepoint=1):
+        moments, levels, columns = ((self.moments_1, self.levels_1, self.columns_1) if timepoint == 1
+                                    else (self.moments_5, self.levels_5, self.columns_5))
+        minimum, q1, median, q3, maximum = levels.quantiles()
+        return pd.DataFrame([moments.count, moments.means(), moments.std_devs(), minimum, q1, median, q3, maximum],
+                            index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'], columns=columns)
+
+    def save(self, path):
+        with open(path, 'wb') as handle:
+            pickle.dump(self, handle)
+
+
+# Function to load a state saved with IncrementalStudyStats.save.
+def load_incremental_stats(path):
+    with open(path, 'rb') as handle:
+        return pickle.load(handle)
@@ -0,0 +1,100 @@
+# Aggregated missingness analysis. sns.heatmap(data.isnull()) draws one cell per participant and column, which is
+# unreadable and slow with hundreds of thousands of rows. MissingnessSummary instead bins consecutive rows into blocks
+# and keeps the number of missing values per block and column, plus how often every pair of columns is missing
+# together (counted on bit-packed missingness masks). Columns are then clustered by their co-missingness patterns,
+# and the map is drawn with one cell per block, so rendering cost depends on the number of bins, not rows.
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import squareform
+
+# Number of set bits in every possible byte, for NumPy versions without np.bitwise_count.
+_bit_counts = np.array([bin(value).count('1') for value in range(256)], dtype='uint8')
+
+
+# Function to count the set bits of a uint8 array element by element.
+def _popcount(packed):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(packed)
+    return _bit_counts[packed]
+
+
+# Missing-value counts collected chunk by chunk (or from one whole DataFrame).
+class MissingnessSummary:
+    def __init__(self, columns, rows_per_bin=1000):
+        self.columns = list(columns)
+        self.rows_per_bin = rows_per_bin
+        self.n_rows = 0
+        self.bin_missing = np.zeros((0, len(self.columns)))
+        self.bin_rows = np.zeros(0)
+        self.missing_counts = np.zeros(len(self.columns))
+        self.co_missing = np.zeros((len(self.columns), len(self.columns)))
+
+    def update(self, chunk):
+        missing = chunk[self.columns].isnull().to_numpy()
+        n_chunk = missing.shape[0]
+        if n_chunk == 0:
+            return
+        # Per-block counts: rows are numbered across all chunks, so a block may span two chunks.
+        bins = (self.n_rows + np.arange(n_chunk)) // self.rows_per_bin
+        n_bins = bins[-1] + 1
+        if n_bins > len(self.bin_rows):
+            self.bin_missing = np.vstack([self.bin_missing, np.zeros((n_bins - len(self.bin_rows), len(self.columns)))])
+            self.bin_rows = np.concatenate([self.bin_rows, np.zeros(n_bins - len(self.bin_rows))])
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        self.bin_missing[bins[starts]] += np.add.reduceat(missing.astype('float64'), starts, axis=0)
+        self.bin_rows[bins[starts]] += np.diff(np.r_[starts, n_chunk])
+        self.n_rows += n_chunk
+        self.missing_counts += missing.sum(axis=0)
+
+        # Co-missingness on packed bitsets: one bit per row, eight rows per byte, one bitset per column.
+        packed = np.packbits(missing, axis=0).T
+        for col in range(len(self.columns)):
+            self.co_missing[col] += _popcount(packed[col] & packed).sum(axis=1)
+
+    # Function returning the fraction missing per block and column, merging neighbouring blocks so that there are
+    # at most max_bins of them.
+    def block_fractions(self, max_bins=200):
+        group = int(np.ceil(len(self.bin_rows) / max_bins)) if len(self.bin_rows) > max_bins else 1
+        starts = np.arange(0, len(self.bin_rows), group)
+        missing = np.add.reduceat(self.bin_missing, starts, axis=0) if len(starts) else self.bin_missing
+        rows = np.add.reduceat(self.bin_rows, starts) if len(starts) else self.bin_rows
+        first_rows = starts * self.rows_per_bin
+        return pd.DataFrame(missing / rows[:, None], index=pd.Index(first_rows, name='first row'),
+                            columns=self.columns)
+
+    # Function returning the Jaccard distance between the missingness patterns of every pair of columns
+    # (0 when two columns are always missing together, 1 when they never are).
+    def co_missing_distance(self):
+        union = self.missing_counts[:, None] + self.missing_counts[None, :] - self.co_missing
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = np.where(union > 0, self.co_missing / union, 1.0)
+        distance = 1.0 - similarity
+        np.fill_diagonal(distance, 0.0)
+        return pd.DataFrame(distance, index=self.columns, columns=self.columns)
+
+    # Function returning the columns ordered so that columns with similar missingness patterns sit together.
+    def clustered_columns(self):
+        if len(self.columns) < 3:
+            return list(self.columns)
+        distance = self.co_missing_distance().to_numpy()
+        order = leaves_list(linkage(squareform(distance, checks=False), method='average'))
+        return [self.columns[i] for i in order]
+
+
+# Function to summarize the missingness of a DataFrame already in memory, using about n_bins row blocks.
+def summarize_missingness(data, n_bins=200):
+    summary = MissingnessSummary(data.columns, rows_per_bin=max(1, int(np.ceil(len(data) / n_bins))))
+    summary.update(data)
+    return summary
+
+
+# Function to draw the aggregated missingness map: one cell per row block and column, columns clustered by
+# co-missingness, colored by the fraction of participants missing.
+def plot_missingness_map(summary, ax, max_bins=200, cmap='viridis'):
+    import seaborn as sns
+    fractions = summary.block_fractions(max_bins=max_bins)[summary.clustered_columns()]
+    sns.heatmap(fractions, ax=ax, cmap=cmap, vmin=0, vmax=1, yticklabels=False,
+                cbar_kws={'label': 'Fraction Missing'})
+    ax.set_ylabel(f"Participants ({summary.n_rows} rows in {len(fractions)} blocks)")
+    return ax
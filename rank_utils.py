@@ -0,0 +1,65 @@
+# Ranking helpers shared by the vectorized statistics engines. Ranks every column of a 2-D array in one pass,
+# giving tied values their average rank (the same convention as scipy.stats.rankdata) and leaving NaNs unranked.
+import numpy as np
+
+
+# Function to compute average ranks column by column. NaN entries stay NaN and are not counted.
+# With return_ties=True it also returns sum(t**3 - t) over the tie groups of each column, used by tie corrections.
+# segment_starts (sorted row offsets, the first one 0) splits the rows into consecutive segments that are ranked
+# separately, all in the same sort; the tie terms then come back per segment and column.
+def average_ranks(values, return_ties=False, segment_starts=None):
+    values = np.asarray(values, dtype='float64')
+    squeeze = values.ndim == 1
+    if squeeze:
+        values = values[:, None]
+    n_rows, n_cols = values.shape
+
+    # Sorts each column once; NaNs go to the end of each column.
+    order = np.argsort(values, axis=0, kind='mergesort')
+    positions = np.arange(1, n_rows + 1, dtype='float64')
+    if segment_starts is not None:
+        # A stable sort by segment keeps the value order inside each segment, with its NaNs at the segment's end.
+        segment_starts = np.asarray(segment_starts, dtype='int64')
+        row_segments = np.repeat(np.arange(len(segment_starts)), np.diff(np.append(segment_starts, n_rows)))
+        segment_order = np.argsort(row_segments[order], axis=0, kind='stable')
+        order = np.take_along_axis(order, segment_order, axis=0)
+        positions -= segment_starts[row_segments]
+    sorted_values = np.take_along_axis(values, order, axis=0)
+
+    # Marks where a new group of equal values starts. NaN != NaN, so every NaN is its own group of size one.
+    starts = np.ones((n_rows, n_cols), dtype=bool)
+    starts[1:] = sorted_values[1:] != sorted_values[:-1]
+    if segment_starts is not None:
+        starts[segment_starts[segment_starts < n_rows]] = True
+
+    # Numbers the groups of all columns consecutively (column-major), then averages the positions in each group.
+    group_ids = np.cumsum(starts.T.ravel()) - 1
+    positions = np.tile(positions, n_cols)
+    group_sizes = np.bincount(group_ids)
+    mean_positions = np.bincount(group_ids, weights=positions) / group_sizes
+    sorted_ranks = mean_positions[group_ids].reshape(n_cols, n_rows).T
+    sorted_ranks[np.isnan(sorted_values)] = np.nan
+
+    # Scatters the ranks back to the original row order.
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=0)
+    if squeeze:
+        ranks = ranks[:, 0]
+    if not return_ties:
+        return ranks
+
+    # Tie term per column; groups of size one contribute nothing, so NaNs never count as ties.
+    group_starts = np.flatnonzero(starts.T.ravel())
+    group_columns = group_starts // n_rows
+    tie_terms = group_sizes ** 3.0 - group_sizes
+    if segment_starts is not None:
+        group_segments = row_segments[group_starts % n_rows]
+        ties = np.zeros((len(segment_starts), n_cols))
+        np.add.at(ties, (group_segments, group_columns), tie_terms)
+        if squeeze:
+            ties = ties[:, 0]
+        return ranks, ties
+    ties = np.bincount(group_columns, weights=tie_terms, minlength=n_cols)
+    if squeeze:
+        ties = ties[0]
+    return ranks, ties
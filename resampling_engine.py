@@ -0,0 +1,175 @@
+# Permutation and bootstrap significance engine for small cohorts. Gives permutation p-values and bootstrap
+# confidence intervals for every Spearman rho of a correlation matrix and for every paired baseline vs after education
+# difference. Resamples are processed in batches as stacked array operations, and the batches are spread over a
+# process pool. Every batch gets its own seed spawned from one SeedSequence, so results are reproducible and do not
+# depend on the number of workers.
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from correlation_engine import standardized_ranks
+from rank_utils import average_ranks
+
+# Arrays shared with the worker processes, set once per worker by _init_worker instead of being sent with every batch.
+_shared = {}
+
+
+# Function to store the shared arrays in a worker process (and in the main process when running without a pool).
+def _init_worker(arrays):
+    _shared.clear()
+    _shared.update(arrays)
+
+
+# Function to pick a batch size so one batch of resampled data stays within max_batch_bytes.
+def _batch_size(bytes_per_resample, max_batch_bytes=128 * 2 ** 20):
+    return int(max(1, max_batch_bytes // max(bytes_per_resample, 1)))
+
+
+# Function to split n_resamples into batches and pair each batch with its own child of seed_sequence.
+def _batches(n_resamples, batch_size, seed_sequence):
+    sizes = [min(batch_size, n_resamples - start) for start in range(0, n_resamples, batch_size)]
+    return list(zip(sizes, seed_sequence.spawn(len(sizes))))
+
+
+# Function to run a batch function over all batches, in a process pool when n_workers > 1, and time it.
+def _run_batches(batch_function, arrays, batches, n_workers):
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    start = time.perf_counter()
+    if n_workers <= 1 or len(batches) == 1:
+        _init_worker(arrays)
+        results = [batch_function(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(arrays,)) as pool:
+            results = list(pool.map(batch_function, batches))
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+# Function to report throughput in resamples per second.
+def _throughput(label, n_resamples, elapsed):
+    rate = n_resamples / elapsed if elapsed > 0 else float('inf')
+    print(f"{label}: {n_resamples} resamples in {elapsed:.2f} s ({rate:,.0f} resamples/s)")
+    return rate
+
+
+# Batch function: counts how often a permuted correlation is at least as extreme as the observed one.
+# Each resample permutes the rows of one side, which breaks every pairing at once.
+def _spearman_permutation_batch(batch):
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    scaled_ranks, observed = _shared['scaled_ranks'], _shared['observed']
+    permutations = rng.permuted(np.tile(np.arange(scaled_ranks.shape[0]), (size, 1)), axis=1)
+    null = np.matmul(scaled_ranks[permutations].transpose(0, 2, 1), scaled_ranks)
+    tolerance = 1e-12
+    return (np.abs(null) >= np.abs(observed) - tolerance).sum(axis=0)
+
+
+# Batch function: bootstrap correlations (lower triangle only) from rows resampled with replacement.
+def _spearman_bootstrap_batch(batch):
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    values = _shared['values']
+    n_rows, n_cols = values.shape
+    samples = values[rng.integers(0, n_rows, size=(size, n_rows))]
+    # Re-ranks all resampled columns of the batch in one call by laying them side by side.
+    scaled_ranks = standardized_ranks(samples.transpose(1, 0, 2).reshape(n_rows, size * n_cols))
+    scaled_ranks = scaled_ranks.reshape(n_rows, size, n_cols).transpose(1, 0, 2)
+    rho = np.matmul(scaled_ranks.transpose(0, 2, 1), scaled_ranks)
+    rows, cols = np.tril_indices(n_cols, k=-1)
+    return rho[:, rows, cols].astype('float32')
+
+
+# Function for permutation p-values and bootstrap percentile confidence intervals of every Spearman rho.
+# Rows with missing values are dropped first. Each permuted matrix is compared in both directions (x_i permuted
+# against x_j and x_j permuted against x_i), so every p-value rests on 2 * n_resamples comparisons.
+# Returns a dict of k x k arrays (rho, p_value, ci_low, ci_high) and the throughput of each engine.
+def spearman_resampling(data, n_resamples=10000, confidence=0.95, n_workers=None, seed=0):
+    values = np.asarray(pd.DataFrame(data).dropna(), dtype='float64')
+    n_rows, n_cols = values.shape
+    scaled_ranks = standardized_ranks(values)
+    rho = np.clip(scaled_ranks.T @ scaled_ranks, -1.0, 1.0)
+    seeds = np.random.SeedSequence(seed).spawn(2)
+
+    batch_size = _batch_size(8 * (n_rows * n_cols + n_cols * n_cols))
+    counts, elapsed = _run_batches(_spearman_permutation_batch, {'scaled_ranks': scaled_ranks, 'observed': rho},
+                                   _batches(n_resamples, batch_size, seeds[0]), n_workers)
+    counts = np.sum(counts, axis=0)
+    p_value = (counts + counts.T + 1) / (2 * n_resamples + 1)
+    np.fill_diagonal(p_value, 0.0)
+    permutation_rate = _throughput('Spearman permutation', n_resamples, elapsed)
+
+    batch_size = _batch_size(8 * (3 * n_rows * n_cols + n_cols * n_cols))
+    samples, elapsed = _run_batches(_spearman_bootstrap_batch, {'values': values},
+                                    _batches(n_resamples, batch_size, seeds[1]), n_workers)
+    bootstrap_rate = _throughput('Spearman bootstrap', n_resamples, elapsed)
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(np.concatenate(samples), [alpha, 1 - alpha], axis=0)
+    ci_low, ci_high = np.eye(n_cols), np.eye(n_cols)
+    rows, cols = np.tril_indices(n_cols, k=-1)
+    ci_low[rows, cols] = ci_low[cols, rows] = low
+    ci_high[rows, cols] = ci_high[cols, rows] = high
+
+    return {'rho': rho, 'p_value': p_value, 'ci_low': ci_low, 'ci_high': ci_high,
+            'permutation_rate': permutation_rate, 'bootstrap_rate': bootstrap_rate}
+
+
+# Batch function: counts sign-flip signed-rank statistics at least as far from their null mean as the observed one.
+def _wilcoxon_permutation_batch(batch):
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    ranks, distance, mean = _shared['ranks'], _shared['distance'], _shared['mean']
+    positive = rng.integers(0, 2, size=(size, ranks.shape[0])).astype('float64')
+    null = positive @ ranks
+    return (np.abs(null - mean) >= distance - 1e-9).sum(axis=0)
+
+
+# Batch function: bootstrap mean paired differences from participants resampled with replacement.
+def _mean_difference_bootstrap_batch(batch):
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    differences = _shared['differences']
+    return differences[rng.integers(0, differences.shape[0], size=(size, differences.shape[0]))].mean(axis=1)
+
+
+# Function for sign-flip permutation p-values of the Wilcoxon signed-rank test and bootstrap percentile confidence
+# intervals of the mean difference (baseline minus after education) for every paired variable.
+# Columns with missing values give NaN, like the Wilcoxon test itself.
+def wilcoxon_resampling(data_1, data_5, n_resamples=10000, confidence=0.95, n_workers=None, seed=0):
+    columns = data_1.columns
+    differences = data_1.to_numpy(dtype='float64') - data_5[columns].to_numpy(dtype='float64')
+    has_nan = np.isnan(differences).any(axis=0)
+    differences = np.where(has_nan, 0.0, differences)
+    seeds = np.random.SeedSequence(seed).spawn(2)
+
+    # Ranks of the absolute non-zero differences; zero differences are dropped as in the Wilcoxon test.
+    ranks = np.nan_to_num(average_ranks(np.abs(np.where(differences == 0, np.nan, differences))))
+    count = (differences != 0).sum(axis=0)
+    mean = count * (count + 1) / 4
+    observed = np.where(differences > 0, ranks, 0).sum(axis=0)
+    arrays = {'ranks': ranks, 'distance': np.abs(observed - mean), 'mean': mean}
+    batch_size = _batch_size(8 * differences.size)
+    counts, elapsed = _run_batches(_wilcoxon_permutation_batch, arrays,
+                                   _batches(n_resamples, batch_size, seeds[0]), n_workers)
+    p_value = (np.sum(counts, axis=0) + 1) / (n_resamples + 1)
+    permutation_rate = _throughput('Wilcoxon sign-flip permutation', n_resamples, elapsed)
+
+    samples, elapsed = _run_batches(_mean_difference_bootstrap_batch, {'differences': differences},
+                                    _batches(n_resamples, batch_size, seeds[1]), n_workers)
+    bootstrap_rate = _throughput('Mean difference bootstrap', n_resamples, elapsed)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(np.concatenate(samples), [alpha, 1 - alpha], axis=0)
+
+    results = pd.DataFrame({
+        'mean difference': differences.mean(axis=0),
+        'ci low': low,
+        'ci high': high,
+        'permutation p-value': p_value,
+    }, index=columns)
+    results.loc[has_nan] = np.nan
+    results.attrs['permutation_rate'] = permutation_rate
+    results.attrs['bootstrap_rate'] = bootstrap_rate
+    return results
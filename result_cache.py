@@ -0,0 +1,181 @@
+# Content-addressed on-disk cache for computed results. Re-rendering a figure with a new title, colormap or star
+# offset used to recompute every correlation and Wilcoxon test. ResultCache keys each result by a hash of the data
+# values, the column names, the method and its parameters, and stores the result arrays in one uncompressed .npz file
+# per entry. Hits refresh the file's modification time, and when the cache grows past max_bytes the least recently
+# used entries are deleted. cached_corr_matrix and cached_wilcoxon_table wrap the pipeline functions with it, and
+# cached_condensed_corr returns the correlations as a CondensedCorrelation without building the full matrices on a hit.
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from condensed_matrix import CondensedCorrelation, condense, expand
+
+# Part of every key; bump it when the statistics engines change their results, so old entries are never reused.
+result_cache_version = 3
+
+# Default cache folder and size limit.
+default_cache_dir = '.result_cache'
+default_max_bytes = 1024 * 2 ** 20
+
+
+# Size-bounded least-recently-used store of named arrays (plus JSON metadata) on disk.
+class ResultCache:
+    def __init__(self, cache_dir=default_cache_dir, max_bytes=default_max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    # Function to build the key of a result from the input frames, the method name and its parameters.
+    @staticmethod
+    def key(frames, method, **params):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps({'version': result_cache_version, 'method': method, 'params': params},
+                                 sort_keys=True, default=str).encode())
+        for frame in frames:
+            values = np.ascontiguousarray(frame.to_numpy(dtype='float64'))
+            digest.update(json.dumps([str(col) for col in frame.columns]).encode())
+            digest.update(np.array(values.shape, dtype='int64').tobytes())
+            digest.update(values.data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    # Function returning (arrays, metadata) for a key, or None when it is not cached.
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files if name != '__meta__'}
+                meta = json.loads(str(entry['__meta__']))
+            os.utime(path)
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays, meta
+
+    # Function to store the arrays and metadata of a key, then evict old entries if the cache is too large.
+    # The file is written under a temporary name first, so readers never see a partial entry.
+    def put(self, key, arrays, meta=None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as handle:
+            np.savez(handle, __meta__=np.array(json.dumps(meta or {})), **arrays)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    # Function to delete the least recently used entries until the cache fits in max_bytes.
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    # Function to delete every entry.
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.npz'):
+                    os.remove(entry.path)
+
+
+# Cache used by the wrappers below when none is passed; created on first use.
+_default_cache = None
+
+
+# Function returning the shared cache, created with the default folder and size limit.
+def get_default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
+
+
+# Function to run create_corr_matrix and store the lower triangles (with the diagonal) of its matrices and attrs under
+# key. The correlation and p-value matrices and the attrs (pair counts, bootstrap confidence intervals) are symmetric,
+# so this halves the size of every entry. Returns the full results and the stored arrays.
+def _compute_corr_entry(data, key, cache, blocked, pairwise, n_resamples):
+    from study_pipeline import create_corr_matrix
+    corr_matrix, p_values = create_corr_matrix(data, blocked=blocked, pairwise=pairwise, n_resamples=n_resamples)
+    arrays = {'corr': condense(corr_matrix.to_numpy(), k=0), 'p_values': condense(p_values.to_numpy(), k=0)}
+    for name, values in corr_matrix.attrs.items():
+        arrays['attr_' + name] = condense(values, k=0)
+    cache.put(key, arrays, {'method': 'spearman', 'n_rows': len(data)})
+    return corr_matrix, p_values, arrays
+
+
+# Function with the same arguments and results as study_pipeline.create_corr_matrix, but cached.
+# Results written to memory-mapped files (blocked=True with out_dir) are not cached.
+def cached_corr_matrix(data, blocked=False, out_dir=None, pairwise=False, n_resamples=0, cache=None):
+    from study_pipeline import create_corr_matrix
+    if out_dir is not None:
+        return create_corr_matrix(data, blocked=blocked, out_dir=out_dir, pairwise=pairwise, n_resamples=n_resamples)
+    cache = cache or get_default_cache()
+    # Blocked and default results are identical, so they share entries.
+    key = cache.key([data], 'spearman', pairwise=pairwise, n_resamples=n_resamples)
+    entry = cache.get(key)
+    columns = data.columns
+    if entry is not None:
+        arrays, _ = entry
+        n_cols = len(columns)
+        corr_matrix = pd.DataFrame(expand(arrays['corr'], n_cols, k=0), index=columns, columns=columns, copy=False)
+        p_values = pd.DataFrame(expand(arrays['p_values'], n_cols, k=0), index=columns, columns=columns, copy=False)
+        for name, values in arrays.items():
+            if name.startswith('attr_'):
+                corr_matrix.attrs[name[len('attr_'):]] = pd.DataFrame(expand(values, n_cols, k=0), index=columns,
+                                                                      columns=columns)
+        return corr_matrix, p_values
+
+    corr_matrix, p_values, _ = _compute_corr_entry(data, key, cache, blocked, pairwise, n_resamples)
+    return corr_matrix, p_values
+
+
+# Function returning the results of create_corr_matrix as a CondensedCorrelation, from the same cache entries as
+# cached_corr_matrix. A hit splits the stored lower triangles into the pairs and the diagonal, so the k x k matrices
+# are never built; a miss computes them once and drops them as soon as they are condensed. The attrs are not kept.
+def cached_condensed_corr(data, blocked=False, pairwise=False, n_resamples=0, cache=None):
+    cache = cache or get_default_cache()
+    key = cache.key([data], 'spearman', pairwise=pairwise, n_resamples=n_resamples)
+    entry = cache.get(key)
+    if entry is not None:
+        arrays, _ = entry
+    else:
+        arrays = _compute_corr_entry(data, key, cache, blocked, pairwise, n_resamples)[2]
+    rows, cols = np.tril_indices(len(data.columns), 0)
+    below = rows != cols
+    return CondensedCorrelation(data.columns, arrays['corr'][below], arrays['p_values'][below],
+                                arrays['corr'][~below])
+
+
+# Function with the same results as wilcoxon_engine.wilcoxon_table, but cached.
+def cached_wilcoxon_table(data_1, data_5, cache=None):
+    from wilcoxon_engine import wilcoxon_table
+    cache = cache or get_default_cache()
+    key = cache.key([data_1, data_5[data_1.columns]], 'wilcoxon')
+    entry = cache.get(key)
+    if entry is not None:
+        arrays, meta = entry
+        return pd.DataFrame(arrays['table'], index=data_1.columns, columns=meta['columns'])
+
+    table = wilcoxon_table(data_1, data_5)
+    cache.put(key, {'table': table.to_numpy(dtype='float64')}, {'method': 'wilcoxon', 'columns': list(table.columns)})
+    return table
@@ -1,105 +1,67 @@
-# Import libraries: Pandas for data manipulation, Seaborn for heat map, matplotlib for displaying it.
-import pandas as pd
-import seaborn as sns
+# Import libraries: matplotlib for displaying the heat map.
 import matplotlib.pyplot as plt
-import numpy as np
-from scipy.stats import spearmanr
-import shutil
+import os
+from figure_export import ExportQueue, render_figures_parallel
+from condensed_matrix import adjust_condensed
+from heatmap_plotting import render_heatmap_file
+from stage_profiler import profiler
+from study_data_loader import load_study_frames, name_mapping
+# Correlation matrix and p-values using vectorization, shared with the combined heatmap script (see study_pipeline.py
+# for the blocked, pairwise and n_resamples options) and cached on disk by the content of the data.
+from result_cache import cached_condensed_corr
 
 # Load csv file
 from google.colab import drive
 drive.mount('/content/drive')
 
-data = pd.read_csv('/content/drive/My Drive/Nick_Paper_Education_Exercise_Study_Data_for_Correlation.csv')
-
-# Numeric data only.
-numeric_data = data.select_dtypes(include=['float64','int64'])
-
-# Exclude specific columns
-exclude_columns = ['PainProblems1', 'PainProblems5']
-
-# Filter data for variables ending in '1' and 'A1', excluding the specified columns
-data_1 = numeric_data.filter(regex='1$|A1$').drop(columns=exclude_columns, errors='ignore')
-# Filter data for variables ending in '5' and 'A2', excluding the specified columns
-data_5 = numeric_data.filter(regex='5$|A2$').drop(columns=exclude_columns, errors='ignore')
-
-# Function to create a correlation matrix and calculate p-values using vectorization
-def create_corr_matrix(data):
-    # Calculates the correlation coefficients and p-values
-    corr, p_values = spearmanr(data, axis=0)
-    
-    # Convert to DataFrames
-    corr_matrix = pd.DataFrame(corr, index=data.columns, columns=data.columns)
-    p_values = pd.DataFrame(p_values, index=data.columns, columns=data.columns)
-    
-    return corr_matrix, p_values
-
-
-# Create correlation matrices and p-values for data_1 and data_5
-corr_matrix_1, p_values_1 = create_corr_matrix(data_1)
-corr_matrix_5, p_values_5 = create_corr_matrix(data_5)
-
-# Rename the columns and index of the correlation matrix and p-values DataFrame
-name_mapping = {
-    'PainDays1': 'Days Manageable Pain',
-    'InterfereActive1': 'Interference Activity',
-    'InterfereMood1' : 'Interference Mood',
-    'InterfereSleep1' : 'Interference Sleep',
-    'HowHard1' : 'Hard to Deal',
-
-    'PainDays5': 'Days Manageable Pain',
-    'InterfereActive5': 'Interference Activity',
-    'InterfereMood5': 'Interference Mood',
-    'InterfereSleep5': 'Interference Sleep',
-    'HowHard5': 'Hard to Deal',
-
-    'Scale1PSA1': 'Pain Severity',
-    'Scale2LIA1': 'Life Interference',
-    'Scale3LCA1': 'Life Control',
-    'Scale4ADA1': 'Affective Distress',
-    'Scale5SA1': 'Support',
-
-    'Scale1PSA2': 'Pain Severity',
-    'Scale2LIA2': 'Life Interference',
-    'Scale3LCA2': 'Life Control',
-    'Scale4ADA2': 'Affective Distress',
-    'Scale5SA2': 'Support'
-}
-
-# Incorporates the naming outlined under name_mapping for ease of reading for the reader when viewing the final matrices. 
-corr_matrix_1.rename(columns=name_mapping, index=name_mapping, inplace=True)
-p_values_1.rename(columns=name_mapping, index=name_mapping, inplace=True)
-corr_matrix_5.rename(columns=name_mapping, index=name_mapping, inplace=True)
-p_values_5.rename(columns=name_mapping, index=name_mapping, inplace=True)
-
-# Function to plot heatmap
-def plot_heatmap(corr_matrix, p_values, title, filename):
-    # The mask is to hide the top half of the heatmap correlations (above r = 1).
-    mask = np.triu(np.ones_like(corr_matrix, dtype=bool), k=1)
-    # Sizing of figure.
-    plt.figure(figsize=(8, 5))
-    # Specs for heatmap. Includes the loop to arrive at significance for each correlation on the heatmap. 
-    sns.heatmap(corr_matrix, annot=True, cmap='RdBu', fmt='.2f', mask=mask, cbar_kws={'label': 'Spearman Correlation'})
-    for i in range(len(corr_matrix.columns)):
-        for j in range(i):
-            p = p_values.iloc[i, j]
-            # When p < 0.01 the ** symbol appears. 
-            if p < 0.01:
-                plt.text(j + 0.5, i + 0.65, '**', ha='center', va='top', color='black')
-            # When p < 0.05 the * symbol appears. 
-            elif p < 0.05:
-                plt.text(j + 0.5, i + 0.65, '*', ha='center', va='top', color='black')
-    # Portrays the title of the image.
-    plt.title(title)
-    # For saving the file with a resolution of 1200, tight to fit within window in Word. 
-    plt.savefig(filename, dpi=1200, bbox_inches='tight')
-    # To exhibit a display of the graphic once the program has started. 
+# Numeric data only, split into variables ending in '1'/'A1' and '5'/'A2', excluding the specified columns. Cached after the first run.
+data_1, data_5 = load_study_frames('/content/drive/My Drive/Nick_Paper_Education_Exercise_Study_Data_for_Correlation.csv')
+
+# Create correlation matrices and p-values for data_1 and data_5, keeping only the lower triangle of each matrix (the
+# part the heatmaps show), and incorporates the naming outlined under name_mapping for ease of reading for the reader
+# when viewing the final matrices.
+results_1 = cached_condensed_corr(data_1).rename(name_mapping)
+results_5 = cached_condensed_corr(data_5).rename(name_mapping)
+
+# Corrects the p-values of all pairs of both timepoints as one family before the significance stars are drawn:
+# 'fdr_bh' (Benjamini-Hochberg), 'holm' (Holm-Bonferroni), or None for the uncorrected p < 0.05 / p < 0.01 stars.
+p_adjust = 'fdr_bh'
+if p_adjust is not None:
+    adjust_condensed([results_1, results_5], p_adjust)
+
+# Folder the heatmaps are saved to, and the formats to save them in (e.g. ('svg', 'pdf', 'png')).
+output_dir = '/content/drive/My Drive/Colab Notebooks'
+export_formats = ('svg',)
+
+# Function to plot heatmap from the condensed results. The cell labels carry the correlation, with ** underneath when
+# p < 0.01 and * when p < 0.05 (adjusted p-values when p_adjust is set). The file is saved with a resolution of 1200,
+# tight to fit within window in Word, and written in the background, under a temporary name that is renamed once
+# complete, while the next heatmap is drawn.
+def plot_heatmap(results, title, filename):
+    render_heatmap_file(results, None, title, os.path.join(output_dir, filename), export_queue=export_queue,
+                        formats=export_formats)
+    # To exhibit a display of the graphic once the program has started.
     plt.show()
 
 # Plot separate heatmaps, one at baseline (symbolize by ending in 1) and the other after education (symbolizes by ending in 5).
-plot_heatmap(corr_matrix_1, p_values_1, 'Spearman Rho Correlation Matrix: Baseline', 'correlation_heatmap_baseline.svg')
-plot_heatmap(corr_matrix_5, p_values_5, 'Spearman Rho Correlation Matrix: After Education', 'correlation_heatmap_after_education.svg')
-
-# This moves the images to Google Drive in the appropriate folder. 
-shutil.move('correlation_heatmap_baseline.svg', '/content/drive/My Drive/Colab Notebooks/correlation_heatmap_baseline.svg')
-shutil.move('correlation_heatmap_after_education.svg', '/content/drive/My Drive/Colab Notebooks/correlation_heatmap_after_education.svg')
+# Set parallel_export to True to render both heatmaps at the same time in worker processes (headless, so without the preview).
+# Either way the images are written straight into the Google Drive folder, so nothing has to be moved afterwards.
+parallel_export = False
+if parallel_export:
+    render_figures_parallel([
+        (render_heatmap_file, {'corr_matrix': results_1, 'p_values': None,
+                               'title': 'Spearman Rho Correlation Matrix: Baseline',
+                               'filename': os.path.join(output_dir, 'correlation_heatmap_baseline.svg')}),
+        (render_heatmap_file, {'corr_matrix': results_5, 'p_values': None,
+                               'title': 'Spearman Rho Correlation Matrix: After Education',
+                               'filename': os.path.join(output_dir, 'correlation_heatmap_after_education.svg')}),
+    ])
+else:
+    with ExportQueue() as export_queue:
+        plot_heatmap(results_1, 'Spearman Rho Correlation Matrix: Baseline', 'correlation_heatmap_baseline')
+        plot_heatmap(results_5, 'Spearman Rho Correlation Matrix: After Education', 'correlation_heatmap_after_education')
+
+# Saves the wall/CPU time, memory use and file sizes of every stage of this run as a Chrome trace (open it in
+# chrome://tracing or Perfetto) and prints them as a table.
+profiler.save_trace('separate_corr_matrices_pain_ed_trace.json')
+print(profiler.summary().to_string(index=False))
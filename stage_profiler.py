@@ -0,0 +1,168 @@
+# Stage-level profiling for the analysis pipeline. The stages shared by the scripts (CSV parsing, the timepoint
+# split, the Spearman and Wilcoxon passes, the heatmap labels and plots, figure export) are wrapped with
+# @profiled_stage, and the scripts wrap their own steps (e.g. moving files to Drive) in `with profile_stage(...)`.
+# Every stage records its wall time, CPU time, resident memory (current and peak) and the size of the files it
+# writes, and the whole run can be saved as a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+# Recording a stage costs some tens of microseconds, so profiling is on by default. Python allocation peaks
+# (tracemalloc) slow down every allocation and are only recorded when trace_allocations is switched on.
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Function to read the current resident set size in bytes (Linux), or None where it is not available.
+def _current_rss():
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Function to read the peak resident set size of the process in bytes so far, or None where it is not available.
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Records of profiled stages for one process.
+class StageProfiler:
+    def __init__(self, enabled=True, trace_allocations=False):
+        self.enabled = enabled
+        self.trace_allocations = trace_allocations
+        self.events = []
+        self._origin_ns = time.perf_counter_ns()
+        self._local = threading.local()
+
+    def _open_stages(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    # Context manager timing one stage. Extra keyword arguments are stored with the stage (e.g. the data shape).
+    @contextmanager
+    def stage(self, name, **metadata):
+        if not self.enabled:
+            yield None
+            return
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            allocated_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        record = {'name': name, 'artifacts': {}, 'metadata': metadata}
+        stack = self._open_stages()
+        stack.append(record)
+        rss_before, peak_before = _current_rss(), _peak_rss()
+        cpu_start = time.process_time()
+        start_ns = time.perf_counter_ns()
+        try:
+            yield record
+        finally:
+            end_ns = time.perf_counter_ns()
+            cpu_seconds = time.process_time() - cpu_start
+            rss_after, peak_after = _current_rss(), _peak_rss()
+            stack.pop()
+            record.update({
+                'start_us': (start_ns - self._origin_ns) / 1000,
+                'wall_seconds': (end_ns - start_ns) / 1e9,
+                'cpu_seconds': cpu_seconds,
+                'rss_bytes': rss_after,
+                'rss_delta_bytes': rss_after - rss_before if rss_before is not None else None,
+                # Growth of the process-wide peak during this stage (0 if the stage stayed below an earlier peak).
+                'peak_rss_delta_bytes': peak_after - peak_before if peak_before is not None else None,
+                'depth': len(stack),
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+            })
+            if tracing:
+                # Inner stages reset the tracemalloc peak, so their peaks are carried up to the enclosing stage.
+                allocated_after, allocated_peak = tracemalloc.get_traced_memory()
+                allocated_peak = max(allocated_peak, record.pop('_inner_peak', 0))
+                record['python_allocated_delta_bytes'] = allocated_after - allocated_before
+                record['python_peak_bytes'] = allocated_peak - allocated_before
+                if stack:
+                    stack[-1]['_inner_peak'] = max(stack[-1].get('_inner_peak', 0), allocated_peak)
+            self.events.append(record)
+
+    # Function to add the size of a file written by the innermost open stage (if any) to its record.
+    def record_artifact(self, path):
+        stack = self._open_stages()
+        if self.enabled and stack:
+            stack[-1]['artifacts'][str(path)] = os.path.getsize(path)
+
+    # Function to clear the recorded stages, e.g. between the datasets of a batch run.
+    def reset(self):
+        self.events = []
+        self._origin_ns = time.perf_counter_ns()
+
+    # Function returning the recorded stages as a DataFrame, one row per stage in the order they started. Inner
+    # stages follow the stage that called them, with depth one higher.
+    def summary(self):
+        import pandas as pd
+        rows = [{
+            'stage': event['name'],
+            'depth': event['depth'],
+            'wall_seconds': event['wall_seconds'],
+            'cpu_seconds': event['cpu_seconds'],
+            'rss_mib': event['rss_bytes'] / 2 ** 20 if event['rss_bytes'] is not None else None,
+            'peak_rss_delta_mib': (event['peak_rss_delta_bytes'] / 2 ** 20
+                                   if event['peak_rss_delta_bytes'] is not None else None),
+            'python_peak_mib': event.get('python_peak_bytes', float('nan')) / 2 ** 20,
+            'artifact_bytes': sum(event['artifacts'].values()),
+        } for event in sorted(self.events, key=lambda event: event['start_us'])]
+        return pd.DataFrame(rows)
+
+    # Function returning the stages in Chrome trace event format: one complete ('X') event per stage.
+    def chrome_trace(self):
+        trace_events = []
+        for event in self.events:
+            arguments = {key: value for key, value in event.items()
+                         if key not in ('name', 'start_us', 'wall_seconds', 'pid', 'tid', 'depth', 'metadata')}
+            arguments.update(event['metadata'])
+            trace_events.append({
+                'name': event['name'], 'cat': 'stage', 'ph': 'X',
+                'ts': event['start_us'], 'dur': event['wall_seconds'] * 1e6,
+                'pid': event['pid'], 'tid': event['tid'], 'args': arguments,
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    # Function to save the trace as JSON. The file can be opened in chrome://tracing or Perfetto.
+    def save_trace(self, path):
+        with open(path, 'w') as handle:
+            json.dump(self.chrome_trace(), handle, default=str)
+        return path
+
+
+# Profiler shared by every module of the pipeline in this process.
+profiler = StageProfiler()
+
+
+# Function returning the shared profiler's context manager for one stage.
+def profile_stage(name, **metadata):
+    return profiler.stage(name, **metadata)
+
+
+# Decorator recording every call of a pipeline function as a stage of the shared profiler.
+def profiled_stage(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiler.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
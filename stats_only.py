@@ -0,0 +1,106 @@
+# Stats-only path: writes the Spearman correlation and p-value matrices of both timepoints and the Wilcoxon table as
+# CSV files, without the figures. Nothing here imports matplotlib, seaborn, scipy.stats or google.colab, and scipy.special
+# is only loaded when the first p-value is computed, so a small job starts in a fraction of the time of the scripts.
+# The correlations come from correlation_engine.blocked_spearman, which gives the same matrices as
+# scipy.stats.spearmanr without importing scipy.stats.
+#
+#     python stats_only.py data.csv --output-dir stats_output --measure-startup
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import study_data_loader
+from study_data_loader import load_study_frames
+from study_pipeline import create_corr_matrix
+from wilcoxon_engine import wilcoxon_table
+
+# Modules the stats-only path must not load.
+plotting_modules = ('matplotlib', 'seaborn', 'scipy.stats', 'google.colab')
+
+
+# Function to compute and write the correlation/p-value matrices of both timepoints and the Wilcoxon table to out_dir.
+# Returns ((corr_matrix_1, p_values_1), (corr_matrix_5, p_values_5)) and the Wilcoxon table.
+def write_stats_tables(data_1, data_5, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    matrices = []
+    for data, label in ((data_1, 'baseline'), (data_5, 'after_education')):
+        corr_matrix, p_values = create_corr_matrix(data, blocked=True)
+        corr_matrix.to_csv(os.path.join(out_dir, f'spearman_rho_{label}.csv'))
+        p_values.to_csv(os.path.join(out_dir, f'spearman_p_{label}.csv'))
+        matrices.append((corr_matrix, p_values))
+    wilcoxon_results = wilcoxon_table(data_1, data_5)
+    wilcoxon_results.to_csv(os.path.join(out_dir, 'wilcoxon_results.csv'))
+    return tuple(matrices), wilcoxon_results
+
+
+# Function to load one study CSV (through the shared cached loader), rename the columns and write the stats tables.
+def run_stats_only(csv_path, output_dir='stats_output', exclude_columns=study_data_loader.exclude_columns,
+                   name_mapping=study_data_loader.name_mapping, use_cache=True):
+    data_1, data_5 = load_study_frames(csv_path, exclude_columns, use_cache=use_cache)
+    data_1 = data_1.rename(columns=name_mapping)
+    data_5 = data_5.rename(columns=name_mapping)
+    return write_stats_tables(data_1, data_5, output_dir)
+
+
+# Code run in a fresh interpreter for one cold start: times the imports and the run, and lists any plotting modules
+# that were loaded.
+_cold_start_code = """
+import json, sys, time
+start = time.perf_counter()
+import stats_only
+imported = time.perf_counter()
+stats_only.run_stats_only(sys.argv[1], sys.argv[2])
+finished = time.perf_counter()
+print(json.dumps({'import_seconds': imported - start, 'run_seconds': finished - imported,
+                  'plotting_modules_loaded': [name for name in stats_only.plotting_modules if name in sys.modules]}))
+"""
+
+
+# Function to measure the cold-start time (a new Python process per run, timed from outside, including interpreter
+# startup and imports) and the warm time (repeated runs in this process) of the stats-only path.
+# The child process runs in the current folder, so relative paths mean the same in both; it finds this module through
+# PYTHONPATH.
+def measure_startup(csv_path, output_dir='stats_output', n_cold=3, n_warm=5):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get('PYTHONPATH')]))
+    cold = []
+    for _ in range(n_cold):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', _cold_start_code, csv_path, output_dir],
+                                   capture_output=True, text=True, check=True, env=env)
+        run = json.loads(completed.stdout.strip().splitlines()[-1])
+        run['process_seconds'] = time.perf_counter() - start
+        cold.append(run)
+
+    run_stats_only(csv_path, output_dir)
+    warm = []
+    for _ in range(n_warm):
+        start = time.perf_counter()
+        run_stats_only(csv_path, output_dir)
+        warm.append(time.perf_counter() - start)
+
+    results = {'cold': cold, 'warm_seconds': warm}
+    for i, run in enumerate(cold):
+        print(f"Cold start {i + 1}: {run['process_seconds']:.3f} s in total "
+              f"(imports {run['import_seconds']:.3f} s, run {run['run_seconds']:.3f} s); "
+              f"plotting modules loaded: {run['plotting_modules_loaded'] or 'none'}")
+    print(f"Warm runs: best {min(warm):.3f} s, worst {max(warm):.3f} s over {n_warm} runs")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the correlation/p-value matrices and the Wilcoxon table '
+                                                 'without drawing any figures.')
+    parser.add_argument('csv_path', nargs='?', default=study_data_loader.default_csv_path)
+    parser.add_argument('--output-dir', default='stats_output')
+    parser.add_argument('--measure-startup', action='store_true', help='report cold-start and warm run times')
+    args = parser.parse_args()
+    if args.measure_startup:
+        measure_startup(args.csv_path, args.output_dir)
+    else:
+        run_stats_only(args.csv_path, args.output_dir)
+        print(f"Saved the correlation matrices, p-values and Wilcoxon results to {args.output_dir}")
@@ -0,0 +1,247 @@
+# Streaming EDA for datasets larger than memory. Data_EDA_Sum.py loads the whole file and then scans it again for
+# describe(), isnull().sum(), value_counts() and hist(). streaming_eda reads the CSV in chunks and collects all of
+# these summaries in a single pass: counts, means and variances (Welford), min/max, approximate quantiles from a
+# small mergeable sketch, missing counts and a block-level missingness map, categorical frequencies, fixed-bin
+# histograms and pairwise-complete Pearson correlations. The plots are then drawn from the summaries, so peak memory
+# is bounded by the chunk size.
+import numpy as np
+import pandas as pd
+
+from incremental_stats import RunningMoments
+from missingness_map import MissingnessSummary
+
+
+# Mergeable quantile sketch for one column: a sorted list of (value, weight) centroids. Distinct values are kept as
+# they are while there are at most `capacity` of them, so the quantiles of ordinal items stay exact; beyond that,
+# neighbouring values are merged into `capacity` buckets of equal weight (rank error of about 1 / capacity).
+class QuantileSketch:
+    def __init__(self, capacity=2000):
+        self.capacity = capacity
+        self.values = np.empty(0)
+        self.weights = np.empty(0)
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        merged, inverse = np.unique(np.concatenate([self.values, values]), return_inverse=True)
+        weights = np.bincount(inverse, weights=np.concatenate([self.weights, np.ones(len(values))]))
+        if len(merged) > self.capacity:
+            cumulative = np.cumsum(weights)
+            buckets = np.minimum(((cumulative - weights) / cumulative[-1] * self.capacity).astype(int),
+                                 self.capacity - 1)
+            bucket_weights = np.bincount(buckets, weights=weights)
+            kept = bucket_weights > 0
+            merged = (np.bincount(buckets, weights=merged * weights)[kept] / bucket_weights[kept])
+            weights = bucket_weights[kept]
+        self.values, self.weights = merged, weights
+
+    # Quantiles with the same linear interpolation as pandas.
+    def quantiles(self, qs):
+        if len(self.values) == 0:
+            return np.full(len(qs), np.nan)
+        cumulative = np.cumsum(self.weights)
+        position = np.asarray(qs) * (cumulative[-1] - 1)
+        lower = self.values[np.minimum(np.searchsorted(cumulative, np.floor(position), side='right'),
+                                       len(self.values) - 1)]
+        upper = self.values[np.minimum(np.searchsorted(cumulative, np.ceil(position), side='right'),
+                                       len(self.values) - 1)]
+        return lower + (position - np.floor(position)) * (upper - lower)
+
+
+# Summaries collected chunk by chunk. numeric_columns and categorical_columns are fixed by the first chunk.
+class StreamingSummary:
+    def __init__(self, first_chunk, bins=20, hist_range=None, sketch_capacity=2000, rows_per_bin=1000):
+        self.columns = list(first_chunk.columns)
+        self.dtypes = first_chunk.dtypes
+        self.numeric_columns = list(first_chunk.select_dtypes(include='number').columns)
+        self.categorical_columns = [col for col in self.columns if col not in self.numeric_columns]
+        n_numeric = len(self.numeric_columns)
+        self.n_rows = 0
+        self.missing = pd.Series(0, index=self.columns)
+        self.missingness = MissingnessSummary(self.columns, rows_per_bin=rows_per_bin)
+        self.moments = RunningMoments(n_numeric)
+        self.minimum = np.full(n_numeric, np.inf)
+        self.maximum = np.full(n_numeric, -np.inf)
+        self.sketches = [QuantileSketch(sketch_capacity) for _ in range(n_numeric)]
+        self.frequencies = {col: pd.Series(dtype='float64') for col in self.categorical_columns}
+        # Pairwise-complete moments for the Pearson correlations. Entry [i, j] is taken over the rows where both i and
+        # j are observed: the pair count, the mean and sum of squared deviations of column i, and the co-moment.
+        self.pair_counts = np.zeros((n_numeric, n_numeric))
+        self.pair_means = np.zeros((n_numeric, n_numeric))
+        self.pair_m2 = np.zeros((n_numeric, n_numeric))
+        self.co_moments = np.zeros((n_numeric, n_numeric))
+        # With a known value range, histogram counts are accumulated chunk by chunk on fixed bins; otherwise they
+        # are built at the end from the sketches over the observed [min, max].
+        self.bins = bins
+        self.hist_range = hist_range
+        self.hist_counts = np.zeros((n_numeric, bins)) if hist_range is not None else None
+
+    def update(self, chunk):
+        if list(chunk.columns) != self.columns:
+            raise ValueError("All chunks must have the same columns.")
+        self.n_rows += len(chunk)
+        self.missing += chunk.isnull().sum()
+        self.missingness.update(chunk)
+        for col in self.categorical_columns:
+            self.frequencies[col] = self.frequencies[col].add(chunk[col].value_counts(), fill_value=0)
+
+        numeric = chunk[self.numeric_columns]
+        if not all(pd.api.types.is_numeric_dtype(dtype) for dtype in numeric.dtypes):
+            raise ValueError("A numeric column holds text in a later chunk; pass an explicit dtype to streaming_eda.")
+        values = numeric.to_numpy(dtype='float64')
+        self.moments.update(values)
+        with np.errstate(invalid='ignore'):
+            self.minimum = np.fmin(self.minimum, np.nanmin(values, axis=0, initial=np.inf))
+            self.maximum = np.fmax(self.maximum, np.nanmax(values, axis=0, initial=-np.inf))
+        for col, sketch in enumerate(self.sketches):
+            sketch.update(values[:, col])
+
+        self._update_pair_moments(values)
+
+        if self.hist_counts is not None:
+            for col in range(values.shape[1]):
+                column = values[:, col]
+                self.hist_counts[col] += np.histogram(column[~np.isnan(column)], bins=self.bins,
+                                                      range=self.hist_range)[0]
+
+    # Merges the pairwise moments of a chunk into the running ones (Chan et al.'s pairwise form of Welford's update,
+    # as in RunningMoments). The chunk is first shifted by its column means, so its own sums stay well conditioned
+    # however large the values are compared with their spread.
+    def _update_pair_moments(self, values):
+        observed = ~np.isnan(values)
+        with np.errstate(invalid='ignore'):
+            shift = np.where(observed.any(axis=0), np.nanmean(np.where(observed, values, np.nan), axis=0), 0.0)
+        shifted = np.where(observed, values - shift, 0.0)
+        observed = observed.astype('float64')
+        batch_count = observed.T @ observed
+        with np.errstate(divide='ignore', invalid='ignore'):
+            batch_mean = np.where(batch_count > 0, (shifted.T @ observed) / batch_count, 0.0)
+        batch_m2 = (shifted ** 2).T @ observed - batch_count * batch_mean ** 2
+        batch_co = shifted.T @ shifted - batch_count * batch_mean * batch_mean.T
+        batch_mean += shift[:, None]
+
+        total = self.pair_counts + batch_count
+        delta = batch_mean - self.pair_means
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(total > 0, self.pair_counts * batch_count / total, 0.0)
+            self.pair_means = np.where(total > 0, self.pair_means + delta * batch_count / total, 0.0)
+        self.pair_m2 += batch_m2 + delta ** 2 * weight
+        self.co_moments += batch_co + delta * delta.T * weight
+        self.pair_counts = total
+
+    # Function returning the same table as DataFrame.describe() (quartiles from the sketches).
+    def describe(self):
+        q1, median, q3 = np.array([sketch.quantiles([0.25, 0.5, 0.75]) for sketch in self.sketches]).T \
+            if self.sketches else (np.empty(0),) * 3
+        minimum = np.where(np.isinf(self.minimum), np.nan, self.minimum)
+        maximum = np.where(np.isinf(self.maximum), np.nan, self.maximum)
+        return pd.DataFrame([self.moments.count, self.moments.means(), self.moments.std_devs(),
+                             minimum, q1, median, q3, maximum],
+                            index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'],
+                            columns=self.numeric_columns)
+
+    # Function returning the frequency counts of a categorical column, like value_counts().
+    def value_counts(self, col):
+        return self.frequencies[col].sort_values(ascending=False).astype('int64')
+
+    # Function returning (counts, bin_edges) of every numeric column, like numeric_data.hist(bins=...).
+    def histograms(self):
+        histograms = {}
+        for col, name in enumerate(self.numeric_columns):
+            if self.hist_counts is not None:
+                edges = np.linspace(self.hist_range[0], self.hist_range[1], self.bins + 1)
+                histograms[name] = (self.hist_counts[col], edges)
+            elif np.isfinite(self.minimum[col]):
+                sketch = self.sketches[col]
+                histograms[name] = np.histogram(sketch.values, bins=self.bins, weights=sketch.weights,
+                                                range=(self.minimum[col], self.maximum[col]))
+        return histograms
+
+    # Function returning the pairwise-complete Pearson correlation matrix, like numeric_data.corr().
+    def corr(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.clip(self.co_moments / np.sqrt(self.pair_m2 * self.pair_m2.T), -1.0, 1.0)
+        corr[self.pair_counts < 2] = np.nan
+        return pd.DataFrame(corr, index=self.numeric_columns, columns=self.numeric_columns)
+
+
+# Function to summarize a CSV file in one pass over chunks of `chunksize` rows. hist_range=(low, high) accumulates
+# exact fixed-bin histograms on that range; without it the histograms come from the quantile sketches, which is exact
+# while a column has at most sketch_capacity distinct values. The missingness map counts missing values in blocks
+# of rows_per_bin rows. Extra keyword arguments go to pd.read_csv.
+def streaming_eda(csv_path, chunksize=100_000, bins=20, hist_range=None, sketch_capacity=2000, rows_per_bin=1000,
+                  **read_csv_kwargs):
+    summary = None
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, **read_csv_kwargs):
+        if summary is None:
+            summary = StreamingSummary(chunk, bins=bins, hist_range=hist_range, sketch_capacity=sketch_capacity,
+                                       rows_per_bin=rows_per_bin)
+        summary.update(chunk)
+    return summary
+
+
+# Function to draw the histograms of all numeric columns from the summary, laid out like DataFrame.hist().
+def plot_histograms(summary, figsize=(12, 10), color='#4E79A7', edgecolor='black'):
+    import matplotlib.pyplot as plt
+    histograms = summary.histograms()
+    n_plots = len(histograms)
+    n_cols = int(np.ceil(np.sqrt(n_plots)))
+    n_rows = int(np.ceil(n_plots / n_cols)) if n_plots else 1
+    fig, axes = plt.subplots(n_rows, n_cols, figsize=figsize, squeeze=False)
+    for ax, (name, (counts, edges)) in zip(axes.ravel(), histograms.items()):
+        ax.stairs(counts, edges, fill=True, color=color, edgecolor=edgecolor)
+        ax.set_title(name)
+    for ax in axes.ravel()[n_plots:]:
+        ax.set_visible(False)
+    return fig
+
+
+# Function to draw horizontal boxplots of the numeric columns from the summary (whiskers at 1.5 IQR, no outlier points).
+def plot_boxplots(summary, ax):
+    import matplotlib.pyplot as plt
+    stats = []
+    for col, name in enumerate(summary.numeric_columns):
+        sketch = summary.sketches[col]
+        if len(sketch.values) == 0:
+            continue
+        q1, median, q3 = sketch.quantiles([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        inside = sketch.values[(sketch.values >= q1 - 1.5 * iqr) & (sketch.values <= q3 + 1.5 * iqr)]
+        stats.append({'label': name, 'med': median, 'q1': q1, 'q3': q3,
+                      'whislo': inside.min(), 'whishi': inside.max(), 'fliers': []})
+    colors = plt.get_cmap('Set2').colors
+    boxes = ax.bxp(stats, orientation='horizontal', patch_artist=True)
+    for patch, color in zip(boxes['boxes'], colors * (len(stats) // len(colors) + 1)):
+        patch.set_facecolor(color)
+    ax.invert_yaxis()
+    return ax
+
+
+# Function to check the streaming summary against pandas on a DataFrame read back in chunks of `chunksize` rows.
+# Returns the largest absolute differences of the means, standard deviations and correlations.
+def check_against_pandas(data, chunksize=1000):
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'data.csv')
+        data.to_csv(path, index=False, float_format='%.17g')
+        summary = streaming_eda(path, chunksize=chunksize)
+        reference = pd.read_csv(path).select_dtypes(include='number')
+    errors = [summary.moments.means() - reference.mean().to_numpy(),
+              summary.moments.std_devs() - reference.std().to_numpy(),
+              summary.corr().to_numpy() - reference.corr().to_numpy()]
+    return tuple(np.nanmax(np.abs(error)) for error in errors)
+
+
+# Checks the streaming summaries against pandas on data with missing values whose columns sit far from zero (offsets
+# up to 1e8 with a spread of about 1), where sums of raw values lose all precision.
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    latent = rng.normal(size=5000)
+    offset_data = pd.DataFrame({
+        'a': 1e8 + latent + 0.5 * rng.normal(size=5000),
+        'b': 1e8 + latent + 0.5 * rng.normal(size=5000),
+        'c': -3e7 - latent + rng.normal(size=5000),
+        'd': rng.integers(0, 10, size=5000).astype('float64'),
+    })
+    offset_data = offset_data.mask(rng.random(offset_data.shape) < 0.1)
+    print('Max |mean|, |std|, |corr| error =', check_against_pandas(offset_data, chunksize=700))
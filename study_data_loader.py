@@ -0,0 +1,394 @@
+# Shared loader for the pain education study data. Every analysis script used to re-parse the same CSV,
+# select the numeric columns and split them into baseline and post-education frames. This module does that
+# once and keeps the split numeric blocks in a columnar cache (.npy files) keyed by the content hash of the CSV,
+# so later runs memory-map the blocks and skip CSV parsing entirely. The cache lives on the local disk, the hash is
+# only recomputed when the file's size or modification time changes, and the entries of an earlier version of a CSV
+# file are deleted once its new blocks are written.
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from stage_profiler import profiled_stage
+
+# Default location of the study CSV on Google Drive.
+default_csv_path = '/content/drive/My Drive/Nick_Paper_Education_Exercise_Study_Data_for_Correlation.csv'
+
+# Default folder of the columnar cache, on the local disk rather than next to the CSV (the mounted Drive folder).
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'study_data_cache')
+
+# Column suffixes for baseline (ending in '1' and 'A1') and after education (ending in '5' and 'A2').
+baseline_regex = '1$|A1$'
+post_regex = '5$|A2$'
+
+# Columns excluded from every analysis: PainProblems1 /""5.
+exclude_columns = ['PainProblems1', 'PainProblems5']
+
+# Creates a mapping to rename columns for better readability in plots.
+name_mapping = {
+    'PainDays1': 'Days Manageable Pain',
+    'InterfereActive1': 'Interference Activity',
+    'InterfereMood1': 'Interference Mood',
+    'InterfereSleep1': 'Interference Sleep',
+    'HowHard1': 'Hard to Deal',
+
+    'PainDays5': 'Days Manageable Pain',
+    'InterfereActive5': 'Interference Activity',
+    'InterfereMood5': 'Interference Mood',
+    'InterfereSleep5': 'Interference Sleep',
+    'HowHard5': 'Hard to Deal',
+
+    'Scale1PSA1': 'Pain Severity',
+    'Scale2LIA1': 'Life Interference',
+    'Scale3LCA1': 'Life Control',
+    'Scale4ADA1': 'Affective Distress',
+    'Scale5SA1': 'Support',
+
+    'Scale1PSA2': 'Pain Severity',
+    'Scale2LIA2': 'Life Interference',
+    'Scale3LCA2': 'Life Control',
+    'Scale4ADA2': 'Affective Distress',
+    'Scale5SA2': 'Support'
+}
+
+# Dtypes selected as numeric data by every analysis: the default int64/float64 columns as well as the compact ones
+# (nullable small integers) produced by read_study_csv(compact=True).
+numeric_dtypes = ['number']
+
+# Compact dtypes of the known study columns. Items answered with whole numbers (days out of 30, 0-10 ratings, yes/no)
+# fit a nullable 8-bit integer, which keeps missing answers as <NA>. The MPI scale scores are means of items (thirds
+# and the like) and stay float64: rounded to float32, equal scores can stop comparing equal after the subtraction in
+# the Wilcoxon test, which changes its ties and zero differences. Text columns are read as category.
+study_schema = {
+    **{f'{item}{wave}': 'Int8' for item in ('PainDays', 'InterfereActive', 'InterfereMood', 'InterfereSleep',
+                                              'HowHard', 'PainProblems') for wave in (1, 5)},
+    **{f'{scale}A{wave}': 'float64' for scale in ('Scale1PS', 'Scale2LI', 'Scale3LC', 'Scale4AD', 'Scale5S')
+       for wave in (1, 2)},
+}
+
+# Bumped whenever the layout of the cached files changes, so stale caches are never reused.
+cache_format_version = 3
+
+
+# Function to hash the raw bytes of the CSV file. Reading bytes is far cheaper than parsing them with pandas.
+def file_content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to read the study CSV file into a Pandas DataFrame.
+# With compact=True the integer columns of the schema are narrowed to their nullable integer dtype after parsing,
+# text columns become category, and the memory saved is printed (see memory_report).
+@profiled_stage('read_csv')
+def read_study_csv(csv_path=default_csv_path, compact=False, schema=study_schema):
+    if not compact:
+        return pd.read_csv(csv_path)
+    data = compact_dtypes(pd.read_csv(csv_path, dtype=_parse_dtypes(schema)), schema)
+    unfit = _unfit_columns(data, schema)
+    if unfit:
+        _reparse_float64(csv_path, data, unfit)
+    report = memory_report(data)
+    print(f"Compact dtypes: {report['bytes'].sum() / 2 ** 20:,.1f} MiB instead of "
+          f"{report['default_bytes'].sum() / 2 ** 20:,.1f} MiB ({report['saved_bytes'].sum() / 2 ** 20:,.1f} MiB saved)")
+    return data
+
+
+# Function telling whether a schema dtype is an integer dtype.
+def _is_integer_dtype(dtype):
+    return pd.api.types.is_integer_dtype(pd.api.types.pandas_dtype(dtype))
+
+
+# Function returning the read_csv dtypes of the compact read. The small-integer items are parsed as float32, which
+# holds their whole numbers exactly at half the size of float64 (pandas wraps out-of-range values around when parsing
+# straight to Int8); the other schema columns are parsed as their own dtype.
+def _parse_dtypes(schema):
+    return {col: 'float32' if _is_integer_dtype(dtype) else dtype for col, dtype in schema.items()}
+
+
+# Function returning the integer columns of the schema that compact_dtypes could not narrow.
+def _unfit_columns(data, schema):
+    return [col for col, dtype in schema.items()
+            if _is_integer_dtype(dtype) and col in data.columns and not pd.api.types.is_integer_dtype(data[col])]
+
+
+# Function to parse columns of the CSV again as float64 and put them into data, for item columns holding values
+# (e.g. fractions) that the float32 parse may have rounded. data is the whole file or a chunk, whose index gives its
+# rows in the file.
+def _reparse_float64(csv_path, data, columns):
+    start = int(data.index[0]) if len(data) else 0
+    exact = pd.read_csv(csv_path, usecols=columns, dtype='float64', skiprows=range(1, start + 1), nrows=len(data))
+    for col in columns:
+        data[col] = exact[col].to_numpy()
+    return data
+
+
+# Function to convert the columns of a parsed frame to the compact dtypes of the schema, one at a time and in place,
+# so no second full copy of the frame is made. Returns the frame. A column is only narrowed to an integer dtype when
+# every value is a whole number in its range; otherwise it becomes float64. Object and string columns become
+# category.
+def compact_dtypes(data, schema=study_schema):
+    for col in data.columns:
+        values = data[col]
+        dtype = schema.get(col)
+        if dtype is not None and _is_integer_dtype(dtype):
+            info = np.iinfo(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+            observed = values.to_numpy()
+            observed = observed[~np.isnan(observed)]
+            fits = np.all((observed == np.round(observed)) & (observed >= info.min) & (observed <= info.max))
+            data[col] = values.astype(dtype) if fits else values.astype('float64')
+        elif dtype is not None:
+            if values.dtype != pd.api.types.pandas_dtype(dtype):
+                data[col] = values.astype(dtype)
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            data[col] = values.astype('category')
+    return data
+
+
+# Function to compare the memory of every column with what pandas' default dtypes would take (8 bytes per numeric
+# value, the plain string column for category columns). Returns a DataFrame of dtype, bytes, default_bytes and
+# saved_bytes.
+def memory_report(data):
+    rows = {}
+    for col in data.columns:
+        values = data[col]
+        used = values.memory_usage(index=False, deep=True)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            default = values.astype(values.cat.categories.dtype).memory_usage(index=False, deep=True)
+        elif pd.api.types.is_numeric_dtype(values):
+            default = 8 * len(values)
+        else:
+            default = used
+        rows[col] = {'dtype': str(values.dtype), 'bytes': used, 'default_bytes': default, 'saved_bytes': default - used}
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+# Function to select numeric data only and split it into baseline and post-education frames.
+# Nullable integer columns come back as float32 with NaN for missing answers (exact for small integers), so every
+# statistics engine can read the frames through numpy.
+@profiled_stage('split_timepoints')
+def split_timepoints(data, exclude_columns=exclude_columns, baseline_regex=baseline_regex, post_regex=post_regex):
+    # Reads numeric data only to avoid column and participant number.
+    numeric_data = data.select_dtypes(include=numeric_dtypes)
+    # Filters baseline and post-education data based on column suffixes, excluding the specified columns.
+    data_1 = numeric_data.filter(regex=baseline_regex).drop(columns=exclude_columns, errors='ignore')
+    data_5 = numeric_data.filter(regex=post_regex).drop(columns=exclude_columns, errors='ignore')
+    return _numpy_dtypes(data_1), _numpy_dtypes(data_5)
+
+
+# Function to turn nullable integer columns into float32 columns with NaN; other columns are returned as they are.
+def _numpy_dtypes(frame):
+    nullable = [col for col, dtype in frame.dtypes.items() if pd.api.types.is_extension_array_dtype(dtype)]
+    if not nullable:
+        return frame
+    return frame.astype({col: 'float32' for col in nullable})
+
+
+# Function returning the content hash of the CSV file. The hash is recorded in cache_dir with the file's size and
+# modification time, and reused while both are unchanged, so an unchanged file is not read again.
+def _content_hash(csv_path, cache_dir):
+    path = os.path.abspath(csv_path)
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, 'file_hashes.json')
+    try:
+        with open(index_path) as handle:
+            hashes = json.load(handle)
+    except (FileNotFoundError, ValueError):
+        hashes = {}
+    recorded = hashes.get(path)
+    if recorded is not None and recorded['size'] == stat.st_size and recorded['mtime_ns'] == stat.st_mtime_ns:
+        return recorded['sha256']
+    content_hash = file_content_hash(path)
+    hashes[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': content_hash}
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as handle:
+        json.dump(hashes, handle)
+    os.replace(temporary_path, index_path)
+    return content_hash
+
+
+# Function to delete the cache entries built from an earlier version of the same CSV file.
+def _evict_stale_entries(cache_dir, csv_path, content_hash):
+    for entry in os.scandir(cache_dir):
+        if not entry.is_dir():
+            continue
+        try:
+            with open(os.path.join(entry.path, 'columns.json')) as handle:
+                meta = json.load(handle)
+        except (FileNotFoundError, ValueError):
+            continue
+        if meta.get('csv_path') == csv_path and meta.get('content_hash') != content_hash:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+# Function to build the cache key from the file contents and everything that changes the split.
+def _cache_key(content_hash, exclude_columns, baseline_regex, post_regex, compact=False):
+    settings = json.dumps({
+        'version': cache_format_version,
+        'compact': compact,
+        'baseline_regex': baseline_regex,
+        'post_regex': post_regex,
+        'exclude_columns': sorted(exclude_columns),
+    }, sort_keys=True)
+    digest = hashlib.sha256()
+    digest.update(content_hash.encode())
+    digest.update(settings.encode())
+    return digest.hexdigest()
+
+
+# Function to save one numeric block as a .npy file. Writes to a temporary file first so a crash never leaves
+# a half-written block behind.
+def _write_block(path, frame, dtype='float64'):
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as handle:
+        np.save(handle, frame.to_numpy(dtype=dtype))
+    os.replace(temporary_path, path)
+
+
+# Function to wrap a memory-mapped block in a DataFrame without copying it.
+def _read_block(path, columns, index):
+    block = np.load(path, mmap_mode='r')
+    return pd.DataFrame(block, index=index, columns=columns, copy=False)
+
+
+# Function to build both cache blocks from the CSV in chunks of `chunksize` rows, so the first run holds one chunk in
+# memory instead of the whole file. The float64 rows of every chunk are appended to a raw file per block, which is then
+# copied into the .npy file in slices of `chunksize` rows, narrowed to float32 when every chunk allowed it (compact
+# small integers). Returns the cache metadata.
+@profiled_stage('build_cache_in_chunks')
+def _write_blocks_in_chunks(paths, csv_path, chunksize, exclude_columns, baseline_regex, post_regex, compact=False):
+    read_csv_kwargs = {'dtype': _parse_dtypes(study_schema)} if compact else {}
+    raw_paths = [path + '.raw' for path in paths]
+    columns = None
+    dtypes = [np.dtype('float32'), np.dtype('float32')]
+    n_rows = 0
+    handles = [open(raw_path, 'wb') for raw_path in raw_paths]
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, **read_csv_kwargs):
+            if compact:
+                chunk = compact_dtypes(chunk)
+                unfit = _unfit_columns(chunk, study_schema)
+                if unfit:
+                    _reparse_float64(csv_path, chunk, unfit)
+            blocks = split_timepoints(chunk, exclude_columns, baseline_regex, post_regex)
+            if columns is None:
+                columns = [block.columns.tolist() for block in blocks]
+            elif [block.columns.tolist() for block in blocks] != columns:
+                raise ValueError("A numeric column holds text in a later chunk; build the cache without chunksize.")
+            for i, (handle, block) in enumerate(zip(handles, blocks)):
+                dtypes[i] = np.result_type(dtypes[i], *block.dtypes)
+                handle.write(block.to_numpy(dtype='float64').tobytes())
+            n_rows += len(blocks[0])
+    finally:
+        for handle in handles:
+            handle.close()
+
+    try:
+        for path, raw_path, block_columns, dtype in zip(paths, raw_paths, columns, dtypes):
+            shape = (n_rows, len(block_columns))
+            temporary_path = path + '.tmp'
+            block = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=dtype, shape=shape)
+            if block.size:
+                raw = np.memmap(raw_path, dtype='float64', mode='r', shape=shape)
+                for start in range(0, n_rows, chunksize):
+                    block[start:start + chunksize] = raw[start:start + chunksize]
+                del raw
+            block.flush()
+            del block
+            os.replace(temporary_path, path)
+    finally:
+        for raw_path in raw_paths:
+            os.remove(raw_path)
+    return {'n_rows': n_rows, 'baseline_columns': columns[0], 'post_columns': columns[1]}
+
+
+# Function to load the baseline and post-education frames, using the columnar cache when it is available.
+# Cached blocks are float64 (float32 with compact=True when every column of a block is a small integer) and
+# memory-mapped read-only; renaming columns on them still works as usual. With chunksize, a cache miss builds the
+# blocks from chunks of that many rows (see _write_blocks_in_chunks) instead of parsing the whole CSV at once.
+# cache_dir defaults to default_cache_dir.
+@profiled_stage('load_study_frames')
+def load_study_frames(csv_path=default_csv_path, exclude_columns=exclude_columns, cache_dir=None, use_cache=True,
+                      baseline_regex=baseline_regex, post_regex=post_regex, compact=False, chunksize=None):
+    if not use_cache:
+        return split_timepoints(read_study_csv(csv_path, compact), exclude_columns, baseline_regex, post_regex)
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+    content_hash = _content_hash(csv_path, cache_dir)
+    entry_dir = os.path.join(cache_dir, _cache_key(content_hash, exclude_columns, baseline_regex, post_regex, compact))
+    meta_path = os.path.join(entry_dir, 'columns.json')
+    baseline_path = os.path.join(entry_dir, 'baseline.npy')
+    post_path = os.path.join(entry_dir, 'post.npy')
+
+    # Cache hit: memory-maps the already-split numeric blocks.
+    if os.path.exists(meta_path):
+        with open(meta_path) as handle:
+            meta = json.load(handle)
+        index = pd.RangeIndex(meta['n_rows'])
+        data_1 = _read_block(baseline_path, meta['baseline_columns'], index)
+        data_5 = _read_block(post_path, meta['post_columns'], index)
+        return data_1, data_5
+
+    # Cache miss: parses the CSV once (whole or in chunks) and stores the split blocks for the next run.
+    os.makedirs(entry_dir, exist_ok=True)
+    if chunksize is None:
+        data_1, data_5 = split_timepoints(read_study_csv(csv_path, compact), exclude_columns, baseline_regex,
+                                          post_regex)
+        _write_block(baseline_path, data_1, np.result_type(*data_1.dtypes, np.float32))
+        _write_block(post_path, data_5, np.result_type(*data_5.dtypes, np.float32))
+        meta = {
+            'n_rows': len(data_1),
+            'baseline_columns': data_1.columns.tolist(),
+            'post_columns': data_5.columns.tolist(),
+        }
+    else:
+        meta = _write_blocks_in_chunks((baseline_path, post_path), csv_path, chunksize, exclude_columns,
+                                       baseline_regex, post_regex, compact)
+    meta['csv_path'] = os.path.abspath(csv_path)
+    meta['content_hash'] = content_hash
+    # The metadata file is written last; its presence marks a complete cache entry.
+    temporary_meta_path = meta_path + '.tmp'
+    with open(temporary_meta_path, 'w') as handle:
+        json.dump(meta, handle)
+    os.replace(temporary_meta_path, meta_path)
+    _evict_stale_entries(cache_dir, meta['csv_path'], content_hash)
+    index = pd.RangeIndex(meta['n_rows'])
+    return _read_block(baseline_path, meta['baseline_columns'], index), \
+        _read_block(post_path, meta['post_columns'], index)
+
+
+# Function to check that the compact dtypes do not change any result: runs create_corr_matrix and wilcoxon_table on
+# the frames of the default and the compact read of the same CSV. Returns True when both Wilcoxon tables are
+# identical and the largest absolute differences of the correlations and their p-values.
+def check_compact_matches_default(csv_path=default_csv_path):
+    from study_pipeline import create_corr_matrix
+    from wilcoxon_engine import wilcoxon_table
+    default_frames = split_timepoints(read_study_csv(csv_path))
+    compact_frames = split_timepoints(read_study_csv(csv_path, compact=True))
+    corr_error = p_error = 0.0
+    for default_frame, compact_frame in zip(default_frames, compact_frames):
+        default_corr, default_p = create_corr_matrix(default_frame)
+        compact_corr, compact_p = create_corr_matrix(compact_frame)
+        corr_error = max(corr_error, np.nanmax(np.abs(default_corr.to_numpy() - compact_corr.to_numpy()), initial=0))
+        p_error = max(p_error, np.nanmax(np.abs(default_p.to_numpy() - compact_p.to_numpy()), initial=0))
+    default_table = wilcoxon_table(*(frame.rename(columns=name_mapping) for frame in default_frames))
+    compact_table = wilcoxon_table(*(frame.rename(columns=name_mapping) for frame in compact_frames))
+    return default_table.equals(compact_table), corr_error, p_error
+
+
+# Compares the compact and default reads on a synthetic study CSV (complete, so every Wilcoxon test is defined).
+if __name__ == '__main__':
+    import tempfile
+
+    from benchmark_suite import synthetic_study_data
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'study.csv')
+        synthetic_study_data(3000, missing_rate=0.0).to_csv(path, index=False)
+        print('Identical Wilcoxon table, max |rho|, |p| error =', check_compact_matches_default(path))
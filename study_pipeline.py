@@ -0,0 +1,166 @@
+# Analysis stages shared by the scripts: the Spearman correlation and p-value matrices, the heatmap panel and the
+# Wilcoxon comparison bar chart. Keeping them here (instead of one copy per script) lets the benchmark suite time
+# exactly what the scripts run. Plotting libraries are imported inside the plotting functions.
+import numpy as np
+import pandas as pd
+
+from correlation_engine import blocked_spearman, pairwise_spearman
+from heatmap_plotting import render_heatmap_file
+from resampling_engine import spearman_resampling
+from stage_profiler import profiled_stage
+
+
+# Function to create a correlation matrix and calculate p-values.
+# blocked=True ranks each column once and computes the matrices tile by tile, for data with thousands of variables;
+# with out_dir set the results are written to memory-mapped files in that folder instead of being held in memory.
+# pairwise=True keeps every participant who answered both items of a pair instead of dropping incomplete rows;
+# the number of participants behind each correlation is kept in corr_matrix.attrs['n'].
+# n_resamples > 0 swaps in permutation p-values (for small cohorts) and keeps bootstrap confidence intervals in
+# corr_matrix.attrs['ci_low'] / corr_matrix.attrs['ci_high']. The resampling drops incomplete rows, and the
+# correlations are then computed on the same rows; it cannot be combined with pairwise=True.
+@profiled_stage('create_corr_matrix')
+def create_corr_matrix(data, blocked=False, out_dir=None, pairwise=False, n_resamples=0):
+    if pairwise and n_resamples:
+        raise ValueError("n_resamples cannot be combined with pairwise=True: the resampled p-values would be "
+                         "computed on complete rows only and replace the pairwise ones.")
+    # Calculates the correlation coefficients and p-values using vectorization.
+    n_pairs = None
+    resampling = None
+    if n_resamples:
+        # The correlations, permutation p-values and confidence intervals all come from the same complete rows;
+        # a correlation that is undefined there (e.g. a constant column) gets no p-value either.
+        resampling = spearman_resampling(data, n_resamples=n_resamples)
+        corr = resampling['rho']
+        p_values = np.where(np.isnan(corr), np.nan, resampling['p_value'])
+    elif pairwise:
+        corr, p_values, n_pairs = pairwise_spearman(data)
+    elif blocked:
+        corr, p_values = blocked_spearman(data, out_dir=out_dir)
+    else:
+        from scipy.stats import spearmanr
+        corr, p_values = spearmanr(data, axis=0)
+
+    # Converts the numpy arrays to pandas DataFrames
+    corr_matrix = pd.DataFrame(corr, index=data.columns, columns=data.columns, copy=False)
+    p_values = pd.DataFrame(p_values, index=data.columns, columns=data.columns, copy=False)
+    if n_pairs is not None:
+        corr_matrix.attrs['n'] = pd.DataFrame(n_pairs, index=data.columns, columns=data.columns)
+    if resampling is not None:
+        corr_matrix.attrs['ci_low'] = pd.DataFrame(resampling['ci_low'], index=data.columns, columns=data.columns)
+        corr_matrix.attrs['ci_high'] = pd.DataFrame(resampling['ci_high'], index=data.columns, columns=data.columns)
+
+    return corr_matrix, p_values
+
+
+# Function to draw the heatmap of a correlation matrix on the current axes, with the p-values as significance markers
+# (see heatmap_plotting.render_heatmap_file). corr_matrix can be a CondensedCorrelation (with p_values=None), whose
+# adjusted p-values then set the stars.
+@profiled_stage('plot_heatmap')
+def plot_heatmap(corr_matrix, p_values, title):
+    render_heatmap_file(corr_matrix, p_values, title, figsize=None)
+
+
+# Function to create a DataFrame combining means, standard deviations, and p-values for plotting.
+@profiled_stage('wilcoxon_plot_data')
+def wilcoxon_plot_data(data_1, data_5, p_values):
+    means_1 = data_1.mean()
+    return pd.DataFrame({
+        "Variable": means_1.index,
+        "Baseline": means_1.values,
+        "After Education": data_5.mean().values,
+        "p-value": np.asarray(p_values),
+        "std_dev_baseline": data_1.std().values,
+        "std_dev_after": data_5.std().values
+    })
+
+
+# Function to draw the grouped bar chart comparing baseline and after education scores, with standard deviation error
+# bars and a bracket with an asterisk over every variable with p < 0.05. Returns the figure.
+@profiled_stage('plot_wilcoxon_bars')
+def plot_wilcoxon_bars(plot_data):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.collections import LineCollection
+    from matplotlib.transforms import ScaledTranslation
+
+    # Reshapes the DataFrame from a wide to long format using melt, making it suitable for seaborn plotting
+    plot_data_melted = plot_data.melt(id_vars=["Variable", "p-value"], value_vars=["Baseline", "After Education"],
+                                      var_name="Condition", value_name="Score")
+
+    # Sets the seaborn theme, this is entirely for aesthetics.
+    sns.set_theme(style="whitegrid")
+    # Creates a grouped bar chart using seaborn to compare the baseline and after education scores.
+    g = sns.catplot(
+        data=plot_data_melted, kind="bar",
+        x="Variable", y="Score", hue="Condition",
+        palette={"Baseline": "white", "After Education": "gray"},
+        alpha=.6, height=6, errorbar=None, edgecolor="black"
+    )
+
+    # Adds the error bars and significance markers for all variables at once.
+    ax = g.ax
+    # Calculates the positions for the bars from the drawn bars themselves (one container per condition, in hue order).
+    baseline_bars, after_bars = ax.containers[:2]
+    pos_baseline = np.array([bar.get_x() + bar.get_width() / 2 for bar in baseline_bars])
+    pos_after = np.array([bar.get_x() + bar.get_width() / 2 for bar in after_bars])
+
+    # Retrieves the mean scores and standard deviations for both conditions as arrays.
+    mean_baseline = plot_data["Baseline"].to_numpy()
+    mean_after = plot_data["After Education"].to_numpy()
+    std_dev_baseline = plot_data["std_dev_baseline"].to_numpy()
+    std_dev_after = plot_data["std_dev_after"].to_numpy()
+
+    # Plots the error bars of both conditions with a single call.
+    ax.errorbar(
+        np.concatenate([pos_baseline, pos_after]),
+        np.concatenate([mean_baseline, mean_after]),
+        yerr=np.concatenate([std_dev_baseline, std_dev_after]),
+        fmt='none', c='black', capsize=5
+    )
+
+    # Checks which p-values indicate statistical significance.
+    significant = plot_data["p-value"].to_numpy() < 0.05
+    if significant.any():
+        # Determines the highest point of the error bars for annotation placement.
+        y_max_baseline = (mean_baseline + std_dev_baseline)[significant]
+        y_max_after = (mean_after + std_dev_after)[significant]
+        # Position above the highest error bar.
+        y_annotation = np.maximum(y_max_baseline, y_max_after) + 0.05
+        x_baseline = pos_baseline[significant]
+        x_after = pos_after[significant]
+
+        # Draws the brackets connecting the two bars as one collection of line segments: the left vertical line from
+        # the top of the Baseline error bar, the horizontal line at the annotation level, and the right vertical line
+        # down to the top of the After Education error bar.
+        segments = np.concatenate([
+            np.stack([np.column_stack([x_baseline, y_max_baseline]), np.column_stack([x_baseline, y_annotation])], axis=1),
+            np.stack([np.column_stack([x_baseline, y_annotation]), np.column_stack([x_after, y_annotation])], axis=1),
+            np.stack([np.column_stack([x_after, y_annotation]), np.column_stack([x_after, y_max_after])], axis=1),
+        ])
+        ax.add_collection(LineCollection(segments, colors='black', linestyles='-', linewidths=0.75))
+        ax.autoscale_view()
+
+        # Adds an asterisk above each bracket to denote statistical significance, all drawn as one marker series.
+        star_offset = ScaledTranslation(0, 5 / 72, ax.figure.dpi_scale_trans)
+        ax.plot(
+            (x_baseline + x_after) / 2, y_annotation,
+            linestyle='none', marker='$*$', markersize=7, color='black',
+            transform=ax.transData + star_offset
+        )
+
+    # Customizes plot aesthetics by removing left spine, setting labels, rotating x-tick labels, adjusting the legend.
+    g.despine(left=True)
+    g.set_axis_labels("Quantitative Measures", "Mean Scores")
+    g.set_xticklabels(rotation=45, ha="right")
+    g.legend.set_title("")
+    g.legend.set_bbox_to_anchor((1, 0.86))
+
+    # Adjusts the layout to ensure the labels and legend are fully visible.
+    plt.tight_layout(rect=[0, 0, 1.2, 1.2])
+
+    # Adds a title to the bar graph.
+    plt.title('Comparison of Quantitative Measures')
+
+    # Adjusts the top margin to make space for the legend.
+    plt.subplots_adjust(top=0.9)
+    return g.figure
@@ -0,0 +1,168 @@
+# Timepoint axis for studies with more than two questionnaire waves. The scripts split the data into data_1 and
+# data_5 with two suffix regexes; build_timepoints parses the suffix of every column with one regex per wave, matches
+# the variables across waves by the rest of their name, and stacks them into one participants x variables x waves
+# array. On that array batched_friedman runs the Friedman test of every variable at once (ranking within each
+# participant only once), posthoc_wilcoxon runs the Wilcoxon signed-rank test of every pair of waves for every variable
+# in one batched call, and wave_corr_matrices gives the Spearman matrices of each wave. With the default two waves the
+# results are the same as create_corr_matrix(data_1), create_corr_matrix(data_5) and wilcoxon_table(data_1, data_5).
+import re
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+import study_data_loader
+from rank_utils import average_ranks
+from wilcoxon_engine import batched_wilcoxon
+
+
+# Function to build the suffix regexes of numbered waves, e.g. waves 1 to 5 of the follow-up study, where the items end
+# in the wave number ('PainDays3') and the scales in 'A' and the wave number ('Scale1PSA3').
+def numbered_wave_patterns(waves=range(1, 6)):
+    return {f'wave {wave}': f'{wave}$|A{wave}$' for wave in waves}
+
+
+# Columns of every wave, stacked on a timepoint axis.
+class Timepoints:
+    def __init__(self, values, variables, waves, wave_columns):
+        self.values = values              # participants x variables x waves, float64
+        self.variables = variables        # variable names (the column names of the first wave)
+        self.waves = waves                # wave labels, in order
+        self.wave_columns = wave_columns  # wave label -> the original column names of that wave
+
+    # Function returning one wave as a DataFrame with its original column names (data_1 or data_5 for two waves).
+    def frame(self, wave):
+        return pd.DataFrame(self.values[:, :, self.waves.index(wave)], columns=self.wave_columns[wave])
+
+
+# Function to split the numeric columns of the study data into waves and stack them. wave_patterns maps every wave
+# label to the regex of its column suffix (default: the baseline and post regexes of study_data_loader). A column
+# belongs to a variable through its name without the suffix, and only variables present in every wave are kept, in
+# the column order of the first wave.
+def build_timepoints(data, wave_patterns=None, exclude_columns=study_data_loader.exclude_columns):
+    if wave_patterns is None:
+        wave_patterns = {'baseline': study_data_loader.baseline_regex, 'post': study_data_loader.post_regex}
+    numeric_data = data.select_dtypes(include=study_data_loader.numeric_dtypes)
+    numeric_data = numeric_data.drop(columns=exclude_columns, errors='ignore')
+
+    stems = {}
+    for wave, pattern in wave_patterns.items():
+        regex = re.compile(pattern)
+        stems[wave] = {}
+        for col in numeric_data.columns:
+            match = regex.search(col)
+            if match is not None:
+                stems[wave][col[:match.start()]] = col
+    waves = list(wave_patterns)
+    shared = [stem for stem in stems[waves[0]] if all(stem in stems[wave] for wave in waves[1:])]
+    if not shared:
+        raise ValueError("No variable is present in every wave; check the wave patterns.")
+
+    wave_columns = {wave: [stems[wave][stem] for stem in shared] for wave in waves}
+    values = np.stack([numeric_data[wave_columns[wave]].to_numpy(dtype='float64') for wave in waves], axis=2)
+    return Timepoints(values, wave_columns[waves[0]], waves, wave_columns)
+
+
+# Function to run the Friedman test on every variable of a participants x variables x waves array, like
+# scipy.stats.friedmanchisquare applied to the waves of each variable. A variable with any missing value gives NaN,
+# as in scipy. Returns a dict of arrays: statistic (tie-corrected chi-square), pvalue, kendalls_w (effect size) and n.
+def batched_friedman(values):
+    from scipy.special import chdtrc
+    values = np.asarray(values, dtype='float64')
+    n_rows, n_cols, n_waves = values.shape
+    if n_waves < 3:
+        raise ValueError("The Friedman test needs at least 3 waves.")
+    has_nan = np.isnan(values).any(axis=(0, 2))
+
+    # Ranks within each participant, for all variables at once: every (participant, variable) is one column.
+    ranks, ties = average_ranks(values.reshape(n_rows * n_cols, n_waves).T, return_ties=True)
+    rank_sums = ranks.T.reshape(n_rows, n_cols, n_waves).sum(axis=0)
+    ties = ties.reshape(n_rows, n_cols).sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = (12.0 / (n_rows * n_waves * (n_waves + 1)) * np.sum(rank_sums ** 2, axis=1)
+                     - 3.0 * n_rows * (n_waves + 1))
+        statistic /= 1 - ties / (n_rows * n_waves * (n_waves * n_waves - 1))
+        kendalls_w = statistic / (n_rows * (n_waves - 1))
+    pvalue = chdtrc(n_waves - 1, statistic)
+    for result in (statistic, pvalue, kendalls_w):
+        result[has_nan] = np.nan
+    return {'statistic': statistic, 'pvalue': pvalue, 'kendalls_w': kendalls_w,
+            'n': np.where(has_nan, np.nan, float(n_rows))}
+
+
+# Function returning the Friedman test of every variable as a table indexed by variable.
+def friedman_table(timepoints):
+    results = batched_friedman(timepoints.values)
+    return pd.DataFrame({
+        'chi-square': results['statistic'],
+        'p-value': results['pvalue'],
+        "Kendall's W": results['kendalls_w'],
+        'n': results['n'],
+    }, index=pd.Index(timepoints.variables, name='variable'))
+
+
+# Function to run the Wilcoxon signed-rank test for every pair of waves and every variable in one batched call.
+# Returns the same columns as wilcoxon_engine.wilcoxon_table, indexed by (first wave, second wave, variable).
+def posthoc_wilcoxon(timepoints, pairs=None):
+    if pairs is None:
+        pairs = list(combinations(timepoints.waves, 2))
+    first = [timepoints.waves.index(a) for a, _ in pairs]
+    second = [timepoints.waves.index(b) for _, b in pairs]
+    # Lays the pairs side by side: column p * n_variables + v holds variable v of pair p.
+    n_rows, n_cols, _ = timepoints.values.shape
+    x = timepoints.values[:, :, first].transpose(0, 2, 1).reshape(n_rows, len(pairs) * n_cols)
+    y = timepoints.values[:, :, second].transpose(0, 2, 1).reshape(n_rows, len(pairs) * n_cols)
+    results = batched_wilcoxon(x, y)
+    index = pd.MultiIndex.from_tuples(
+        [(a, b, variable) for a, b in pairs for variable in timepoints.variables],
+        names=['wave a', 'wave b', 'variable'])
+    return pd.DataFrame({
+        'statistic': results['statistic'],
+        'z-score': results['zstatistic'],
+        'p-value': results['pvalue'],
+        'effect size': results['effect_size'],
+        'n': results['n'],
+    }, index=index)
+
+
+# Function returning {wave: (corr_matrix, p_values)} for every wave; keyword arguments go to create_corr_matrix.
+def wave_corr_matrices(timepoints, **corr_kwargs):
+    from study_pipeline import create_corr_matrix
+    return {wave: create_corr_matrix(timepoints.frame(wave), **corr_kwargs) for wave in timepoints.waves}
+
+
+# Function to check that two waves reproduce the two-timepoint pipeline on the same data. Returns the largest absolute
+# differences of the correlations, their p-values and the Wilcoxon p-values.
+def check_two_timepoints(data):
+    from study_pipeline import create_corr_matrix
+    from wilcoxon_engine import wilcoxon_table
+    data_1, data_5 = study_data_loader.split_timepoints(data)
+    timepoints = build_timepoints(data)
+    matrices = wave_corr_matrices(timepoints)
+    corr_error = p_error = 0.0
+    for frame, (corr_matrix, p_values) in zip((data_1, data_5), matrices.values()):
+        reference_corr, reference_p = create_corr_matrix(frame)
+        corr_error = max(corr_error, np.nanmax(np.abs(corr_matrix.to_numpy() - reference_corr.to_numpy())))
+        p_error = max(p_error, np.nanmax(np.abs(p_values.to_numpy() - reference_p.to_numpy())))
+    reference = wilcoxon_table(data_1, data_5.set_axis(data_1.columns, axis=1))
+    posthoc = posthoc_wilcoxon(timepoints)
+    wilcoxon_error = np.nanmax(np.abs(posthoc['p-value'].to_numpy() - reference['p-value'].to_numpy()))
+    return corr_error, p_error, wilcoxon_error
+
+
+# Checks the two-wave results against the current pipeline and the Friedman tests against scipy, on synthetic data.
+if __name__ == '__main__':
+    from scipy.stats import friedmanchisquare
+
+    from benchmark_suite import synthetic_study_data
+    print('Two waves: max |rho|, |p|, |Wilcoxon p| error =',
+          check_two_timepoints(synthetic_study_data(300, missing_rate=0.0)))
+
+    rng = np.random.default_rng(0)
+    waves = rng.integers(0, 5, size=(40, 6, 4)).astype('float64')
+    waves[:, :, 3] -= rng.integers(0, 2, size=(40, 6))
+    friedman = batched_friedman(waves)
+    reference = np.array([friedmanchisquare(*waves[:, col, :].T) for col in range(waves.shape[1])])
+    print('Friedman: max |statistic|, |p| error =', np.max(np.abs(friedman['statistic'] - reference[:, 0])),
+          np.max(np.abs(friedman['pvalue'] - reference[:, 1])))